@@ -1,14 +1,32 @@
 import json
+from itertools import groupby
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, stream_template, request, Response, flash, redirect, url_for, jsonify
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from models import Venue, Artist, Show
 from serializers import serialize_show, serialize_artist, serialize_venue
+from serializers.utils import select_page_shows, serialize_show_row
 from config import app, db
+from assets import register_assets
+from profiling import register_profiling
+from counters import register_counters
+from deletion import delete_entity
+from editing import (
+    CONFLICT, UNCHANGED, UPDATED, dump_snapshot, form_data, form_values, load_snapshot, update_entities, update_entity
+)
+from scheduling import schedule_shows
+from search_cache import register_search_cache
+from search import register_search, search
+from calendar_feeds import calendar_response
+from timeline import register_timeline
+from metrics import register_metrics
+from template_cache import register_template_cache
+from loadtest import register_loadtest
+from sqlalchemy.exc import SQLAlchemyError
 
 
 def format_datetime(value, format='medium'):
@@ -28,6 +46,39 @@ def format_datetime(value, format='medium'):
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+def render_listing(template_name, **context):
+    """
+    Render a listing page, streaming it in chunks when `STREAM_LISTINGS` is on.
+
+    :param template_name:
+    :param context:
+    """
+    if not app.config['STREAM_LISTINGS']:
+        return render_template(template_name, **context)
+
+    def buffered(fragments):
+        chunk, size = [], 0
+        for fragment in fragments:
+            chunk.append(fragment)
+            size += len(fragment)
+            if size >= app.config['STREAM_BUFFER_SIZE']:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+        yield ''.join(chunk)
+
+    return Response(buffered(stream_template(template_name, **context)))
+
+register_template_cache(app)
+register_assets(app)
+register_profiling(app)
+register_counters(app)
+register_metrics(app)
+search_cache = register_search_cache(app)
+register_search(app)
+show_timeline = register_timeline(app)
+register_loadtest(app)
+
+
 @app.route('/')
 def index():
     """
@@ -36,13 +87,78 @@ def index():
     return render_template('pages/home.html')
 
 
+def sorted_query(model, *order_by):
+    """
+    Query for `model`, ordered by `order_by` then by the `sort` request argument.
+
+    :param model:
+    :param order_by:
+    """
+    query = model.query.order_by(*order_by)
+    if request.args.get('sort') == 'busiest':
+        query = query.order_by(model.num_upcoming_shows.desc(), model.id)
+    return query
+
+
+def find_venues(term):
+    """
+    Venues whose name contains `term`, serialized for the search page.
+
+    :param term:
+    """
+    return serialize_venue(Venue.query.filter(Venue.name.ilike(f'%{term}%')), many=True)
+
+
+def find_artists(term):
+    """
+    Artists whose name contains `term`, serialized for the search page.
+
+    :param term:
+    """
+    return serialize_artist(Artist.query.filter(Artist.name.ilike(f'%{term}%')), many=True)
+
+
+def page_shows(model, id):
+    """
+    Past and upcoming shows of a venue or artist page, one joined query each
+    or from the show timeline.
+
+    :param model:
+    :param id:
+    """
+    if show_timeline is not None:
+        return show_timeline.page_shows(model, id)
+    return {
+        f'{"upcoming" if upcoming else "past"}_shows': [
+            serialize_show_row(row) for row in db.session.execute(select_page_shows(model, id, upcoming))
+        ] for upcoming in (False, True)
+    }
+
+
+@app.route('/search')
+def search_all():
+    """
+    Controller to search venues, artists and upcoming shows at once.
+    """
+    search_term = request.args.get('q', '')
+    return render_template('pages/search.html', results=search(search_term), search_term=search_term)
+
+
 @app.route('/venues')
 def venues():
     """
     Controller to list all venues.
     """
+    if app.config['STREAM_LISTINGS']:
+        venues = serialize_venue(sorted_query(Venue, Venue.city, Venue.state), many=True, stream=True)
+        areas = (
+            {'city': city, 'state': state, 'venues': list(group)}
+            for (city, state), group in groupby(venues, key=lambda venue: (venue['city'], venue['state']))
+        )
+        return render_listing('pages/venues.html', areas=areas)
+
     data = {}
-    for venue in serialize_venue(Venue.query.all(), many=True, summarized=False):
+    for venue in serialize_venue(sorted_query(Venue), many=True):
         if venue['city'] not in data:
             data[venue['city']] = {
                 'state': venue['state'],
@@ -61,8 +177,8 @@ def search_venues():
     """
     Controller to search venues.
     """
-    search_term = request.form.get('search_term')
-    venues = serialize_venue(Venue.query.filter(Venue.name.ilike(f'%{search_term}%')), many=True)
+    search_term = request.form.get('search_term', '')
+    venues = search_cache.get_or_compute('venue', search_term, find_venues)
     response={
         "count": len(venues), "data": venues
     }
@@ -76,10 +192,20 @@ def show_venue(venue_id):
 
     :param venue_id:
     """
-    venue = serialize_venue(Venue.query.get(venue_id), summarized=False)
+    venue = serialize_venue(Venue.query.get_or_404(venue_id), summarized=False, **page_shows(Venue, venue_id))
     return render_template('pages/show_venue.html', venue=venue)
 
 
+@app.route('/venues/<int:venue_id>/calendar.ics')
+def venue_calendar(venue_id):
+    """
+    Controller to serve a venue's shows as an iCalendar feed.
+
+    :param venue_id:
+    """
+    return calendar_response(Venue.query.get_or_404(venue_id))
+
+
 @app.route('/venues/create', methods=['GET'])
 def create_venue_form():
     """
@@ -110,21 +236,33 @@ def create_venue_submission():
     return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
-def delete_venue(venue_id):
+def delete_submission(model, id):
     """
-    Controller to delete venue based on venue_id.
+    Delete a venue or an artist and report the outcome as JSON.
 
-    :param venue_id:
+    :param model:
+    :param id:
     """
     try:
-        Venue.query.filter_by(id=venue_id).delete()
+        deleted = delete_entity(model, id)
         db.session.commit()
-    except:
+    except SQLAlchemyError as ex:
         db.session.rollback()
+        app.logger.error(f'Couldn\'t delete {model.__tablename__} {id}: {ex}')
+        return jsonify({'success': False}), 500
     finally:
         db.session.close()
-    return render_template('pages/home.html')
+    return jsonify({'success': deleted}), 200 if deleted else 404
+
+
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
+def delete_venue(venue_id):
+    """
+    Controller to delete venue based on venue_id.
+
+    :param venue_id:
+    """
+    return delete_submission(Venue, venue_id)
 
 
 @app.route('/artists')
@@ -132,8 +270,8 @@ def artists():
     """
     Controller to list all the artists.
     """
-    artists = serialize_artist(Artist.query.all(), many=True)
-    return render_template('pages/artists.html', artists=artists)
+    artists = serialize_artist(sorted_query(Artist), many=True, stream=app.config['STREAM_LISTINGS'])
+    return render_listing('pages/artists.html', artists=artists)
 
 
 @app.route('/artists/search', methods=['POST'])
@@ -142,7 +280,7 @@ def search_artists():
     Controller to search artists.
     """
     search_term = request.form.get('search_term', '')
-    artists = serialize_artist(Artist.query.filter(Artist.name.ilike(f'%{search_term}%')), many=True)
+    artists = search_cache.get_or_compute('artist', search_term, find_artists)
     response={
         "count": len(artists), "data": artists
     }
@@ -156,49 +294,138 @@ def show_artist(artist_id):
 
     :param artist_id:
     """
-    artist = serialize_artist(Artist.query.get(artist_id), summarized=False)
+    artist = serialize_artist(Artist.query.get_or_404(artist_id), summarized=False, **page_shows(Artist, artist_id))
     return render_template('pages/show_artist.html', artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
-def edit_artist(artist_id):
+@app.route('/artists/<int:artist_id>/calendar.ics')
+def artist_calendar(artist_id):
     """
-    Controller to render edit artist form.
+    Controller to serve an artist's shows as an iCalendar feed.
 
     :param artist_id:
     """
-    artist = Artist.query.get(artist_id)
-    serialized_artist = serialize_artist(artist, summarized=False)
-    form = ArtistForm(obj=artist)
-    return render_template('forms/edit_artist.html', form=form, artist=serialized_artist)
+    return calendar_response(Artist.query.get_or_404(artist_id))
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
-def edit_artist_submission(artist_id):
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
     """
-    Controller to edit artist.
+    Controller to delete artist based on artist_id.
 
     :param artist_id:
     """
-    artist = Artist.query.get(artist_id)
-    for field in [
-        "name", "city", "state", "phone", "website", "facebook_link",
-        "seeking_description", "image_link", "genres"
-    ]:
-        setattr(artist, field, request.form.get(field))
-    artist.seeking_venue = request.form.get('seeking_venue') == 'y'
+    return delete_submission(Artist, artist_id)
+
+
+def edit_form(model, entity, form_class, template_name, **context):
+    """
+    Render the edit form of a venue or an artist with its version and snapshot.
+
+    :param model:
+    :param entity:
+    :param form_class:
+    :param template_name:
+    """
+    form = form_class(data=form_data(model, entity))
+    return render_template(
+        template_name, form=form, version=entity.version, snapshot=dump_snapshot(model, entity), **context
+    )
+
+
+def edit_submission(model, id, label):
+    """
+    Apply an edit form as a partial update and flash the outcome.
+
+    Returns whether the edit was saved or had nothing to save.
 
+    :param model:
+    :param id:
+    :param label:
+    """
+    snapshot = load_snapshot(model, id, request.form.get('snapshot'))
+    version, original = snapshot or (request.form.get('version', type=int), None)
+    submitted = form_values(model, request.form)
+    name = submitted['name'] or (original or {}).get('name') or ''
     try:
+        status, _ = update_entity(model, id, version, submitted, original)
         db.session.commit()
-        flash(f'Artist {artist.name} was successfully updated.')
-    except Exception as ex:
-        print(ex)
+    except SQLAlchemyError as ex:
+        db.session.rollback()
+        app.logger.error(f'Couldn\'t update {model.__tablename__} {id}: {ex}')
+        flash(f'{label} `{name}` couldn\'t be updated.')
+        return False
+    finally:
+        db.session.close()
+
+    if status == UPDATED:
+        flash(f'{label} {name} was successfully updated.')
+    elif status == UNCHANGED:
+        flash(f'{label} {name} has no changes to save.')
+    elif status == CONFLICT:
+        flash(f'{label} `{name}` was changed by someone else in the meantime. Review it and edit it again.')
+    else:
+        flash(f'{label} `{name}` no longer exists.')
+    return status in (UPDATED, UNCHANGED)
+
+
+def patch_submission(model):
+    """
+    Apply a JSON list of partial updates in one transaction and report the
+    outcome of each as JSON.
+
+    :param model:
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({'success': False, 'error': 'Expected a JSON list of updates.'}), 400
+
+    try:
+        results = update_entities(model, items)
+        db.session.commit()
+    except SQLAlchemyError as ex:
         db.session.rollback()
-        flash(f'Artist `{artist.name}` couldn\'t be updated.')
+        app.logger.error(f'Couldn\'t update {model.__tablename__} rows: {ex}')
+        return jsonify({'success': False, 'results': []}), 500
     finally:
         db.session.close()
 
-    return redirect(url_for('show_artist', artist_id=artist_id))
+    success = all(result['status'] in (UPDATED, UNCHANGED) for result in results)
+    return jsonify({'success': success, 'results': results}), 200 if success else 409
+
+
+@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+def edit_artist(artist_id):
+    """
+    Controller to render edit artist form.
+
+    :param artist_id:
+    """
+    artist = Artist.query.get_or_404(artist_id)
+    return edit_form(
+        Artist, artist, ArtistForm, 'forms/edit_artist.html', artist={'id': artist.id, 'name': artist.name}
+    )
+
+
+@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+def edit_artist_submission(artist_id):
+    """
+    Controller to edit artist, writing only the changed fields.
+
+    :param artist_id:
+    """
+    if edit_submission(Artist, artist_id, 'Artist'):
+        return redirect(url_for('show_artist', artist_id=artist_id))
+    return redirect(url_for('edit_artist', artist_id=artist_id))
+
+
+@app.route('/artists', methods=['PATCH'])
+def patch_artists():
+    """
+    Controller to update many artists from a JSON list of
+    `{"id", "version", <field>: <value>, ...}` objects.
+    """
+    return patch_submission(Artist)
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
@@ -208,33 +435,29 @@ def edit_venue(venue_id):
 
     :param venue_id:
     """
-    venue = Venue.query.get(venue_id)
-    serialized_venue = serialize_venue(venue, summarized=False)
-    form = VenueForm(obj=venue)
-    return render_template('forms/edit_venue.html', form=form, venue=serialized_venue)
+    venue = Venue.query.get_or_404(venue_id)
+    return edit_form(Venue, venue, VenueForm, 'forms/edit_venue.html', venue={'id': venue.id, 'name': venue.name})
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-    venue = Venue.query.get(venue_id)
-    for field in [
-        "name", "city", "state", "phone", "website", "facebook_link",
-        "seeking_description", "image_link", "genres"
-    ]:
-        setattr(venue, field, request.form.get(field))
-    venue.seeking_talent = request.form.get('seeking_talent', False)
+    """
+    Controller to edit venue, writing only the changed fields.
+
+    :param venue_id:
+    """
+    if edit_submission(Venue, venue_id, 'Venue'):
+        return redirect(url_for('show_venue', venue_id=venue_id))
+    return redirect(url_for('edit_venue', venue_id=venue_id))
 
-    try:
-        db.session.commit()
-        flash(f'Venue {venue.name} was successfully updated.')
-    except Exception as ex:
-        print(ex)
-        db.session.rollback()
-        flash(f'Venue `{venue.name}` couldn\'t be updated.')
-    finally:
-        db.session.close()
 
-    return redirect(url_for('show_venue', venue_id=venue_id))
+@app.route('/venues', methods=['PATCH'])
+def patch_venues():
+    """
+    Controller to update many venues from a JSON list of
+    `{"id", "version", <field>: <value>, ...}` objects.
+    """
+    return patch_submission(Venue)
 
 
 @app.route('/artists/create', methods=['GET'])
@@ -272,8 +495,10 @@ def shows():
     """
     Controller to display all shows.
     """
-    shows = serialize_show(Show.query.all(), many=True)
-    return render_template('pages/shows.html', shows=shows)
+    if show_timeline is not None:
+        return render_listing('pages/shows.html', shows=show_timeline.shows())
+    shows = serialize_show(Show.query, many=True, stream=app.config['STREAM_LISTINGS'])
+    return render_listing('pages/shows.html', shows=shows)
 
 
 @app.route('/shows/create')
@@ -288,22 +513,54 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     """
-    Controller to handle show scheduling.
+    Controller to handle show scheduling, optionally recurring.
     """
     try:
-        show = Show(**request.form)
-        db.session.add(show)
+        created, failures = schedule_shows([request.form.to_dict()])
         db.session.commit()
-        flash(f'Show was successfully listed.')
-    except Exception as ex:
+        if created:
+            flash(f'{created} show(s) were successfully listed.')
+        for failure in failures:
+            show = f'Show {failure["start_time"]}' if failure['start_time'] else 'Show'
+            flash(f'{show} couldn\'t be listed: {failure["error"]}')
+    except SQLAlchemyError as ex:
         db.session.rollback()
-        print(ex)
+        app.logger.error(f'Couldn\'t list show: {ex}')
         flash(f'Show couldn\'t be listed.')
     finally:
         db.session.close()
     return render_template('pages/home.html')
 
 
+@app.route('/shows/batch', methods=['POST'])
+def create_shows_batch():
+    """
+    Controller to schedule many shows from a JSON list in one transaction.
+
+    Each item takes `artist_id`, `venue_id`, `start_time` and optionally
+    `repeat` (`weekly` or `monthly`) with `repeat_until`.
+    """
+    requests = request.get_json(silent=True)
+    if not isinstance(requests, list):
+        return jsonify({'success': False, 'error': 'Expected a JSON list of shows.'}), 400
+
+    try:
+        created, failures = schedule_shows(requests)
+        db.session.commit()
+    except SQLAlchemyError as ex:
+        db.session.rollback()
+        app.logger.error(f'Couldn\'t schedule shows: {ex}')
+        return jsonify({'success': False, 'created': 0, 'failures': []}), 500
+    finally:
+        db.session.close()
+
+    if failures:
+        status = 207 if created else 400
+    else:
+        status = 201 if created else 200
+    return jsonify({'success': not failures, 'created': created, 'failures': failures}), status
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     """
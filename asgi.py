@@ -0,0 +1,320 @@
+"""Async read path for `Fyyur` app.
+
+`application` is an ASGI app, served with e.g. `uvicorn asgi:application`.
+The read-only routes (the venue, artist and show listings, the venue and
+artist pages and the searches) are handled by coroutines querying through an
+async SQLAlchemy engine, so a request waiting on the database doesn't hold a
+worker thread. Queries a page needs independently, such as a venue and its
+past and upcoming shows, run concurrently on separate connections. The venue
+and artist name searches go through the search cache shared with the Flask
+views instead, computing misses on a thread. With `SHOW_TIMELINE` on, `/shows`
+and the past and upcoming shows of the venue and artist pages come from the
+show timeline, read on a thread since it may refresh from the database.
+
+These views keep the Flask endpoints, templates and request hooks: each one
+runs inside a Flask request context, with `before_request`, `after_request`
+and the error handlers applied as usual. Every other route, including all
+writes, is passed to the Flask WSGI app on a thread pool.
+
+The async engine connects to `ASYNC_DATABASE_URI`, which defaults to
+`SQLALCHEMY_DATABASE_URI` with its driver swapped for `asyncpg` or `aiosqlite`.
+"""
+
+import asyncio
+import sys
+from io import BytesIO
+from itertools import groupby
+
+from a2wsgi import WSGIMiddleware
+from flask import abort, render_template, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import app, find_artists, find_venues, search_cache, show_timeline
+from config import db
+from models import Venue, Artist
+from search import TYPES, empty_search, merge_results, search_results, search_statement
+from search_cache import normalize_term
+from serializers import serialize_artist, serialize_venue
+from serializers.utils import (
+    SUMMARIZED_ARTIST_COLUMNS, SUMMARIZED_VENUE_COLUMNS,
+    select_page_shows, select_shows, serialize_show_row, serialize_summarized_row
+)
+
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+ASYNC_VIEWS = {}
+
+
+def async_database_uri(uri):
+    """
+    `uri` with its driver replaced by the matching async driver.
+
+    :param uri:
+    """
+    url = make_url(uri)
+    backend = 'postgresql' if url.get_backend_name() in ('postgres', 'postgresql') else url.get_backend_name()
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+engine = create_async_engine(
+    app.config.get('ASYNC_DATABASE_URI') or async_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+wsgi_application = WSGIMiddleware(app, workers=app.config['ASYNC_WSGI_THREADS'])
+
+
+async def fetch_all(statement):
+    async with Session() as session:
+        return (await session.execute(statement)).all()
+
+
+async def fetch_one(model, id):
+    async with Session() as session:
+        return await session.get(model, id)
+
+
+def async_view(endpoint):
+    """
+    Register a coroutine as the async handler of a Flask endpoint.
+
+    :param endpoint:
+    """
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+    return decorator
+
+
+def sorted_select(model, columns, *order_by):
+    """
+    Select `columns`, ordered by `order_by` then by the `sort` request argument.
+
+    :param model:
+    :param columns:
+    :param order_by:
+    """
+    statement = db.select(*columns).order_by(*order_by)
+    if request.args.get('sort') == 'busiest':
+        statement = statement.order_by(model.num_upcoming_shows.desc(), model.id)
+    return statement
+
+
+@async_view('venues')
+async def venues():
+    rows = await fetch_all(sorted_select(Venue, SUMMARIZED_VENUE_COLUMNS, Venue.city, Venue.state))
+    areas = [
+        {'city': city, 'state': state, 'venues': [serialize_summarized_row(row) for row in group]}
+        for (city, state), group in groupby(rows, key=lambda row: (row.city, row.state))
+    ]
+    return render_template('pages/venues.html', areas=areas)
+
+
+@async_view('artists')
+async def artists():
+    rows = await fetch_all(sorted_select(Artist, SUMMARIZED_ARTIST_COLUMNS))
+    return render_template('pages/artists.html', artists=[serialize_summarized_row(row) for row in rows])
+
+
+@async_view('shows')
+async def shows():
+    if show_timeline is not None:
+        return render_template('pages/shows.html', shows=await asyncio.to_thread(show_timeline.shows))
+    rows = await fetch_all(select_shows())
+    return render_template('pages/shows.html', shows=[serialize_show_row(row) for row in rows])
+
+
+async def fetch_page(model, id):
+    """
+    A venue or an artist with its past and upcoming shows, queried concurrently.
+
+    :param model:
+    :param id:
+    """
+    if show_timeline is not None:
+        entity, shows = await asyncio.gather(
+            fetch_one(model, id), asyncio.to_thread(show_timeline.page_shows, model, id)
+        )
+        if entity is None:
+            abort(404)
+        return entity, shows
+    entity, past_shows, upcoming_shows = await asyncio.gather(
+        fetch_one(model, id),
+        fetch_all(select_page_shows(model, id, upcoming=False)),
+        fetch_all(select_page_shows(model, id, upcoming=True)),
+    )
+    if entity is None:
+        abort(404)
+    return entity, {
+        'past_shows': [serialize_show_row(row) for row in past_shows],
+        'upcoming_shows': [serialize_show_row(row) for row in upcoming_shows],
+    }
+
+
+@async_view('show_venue')
+async def show_venue(venue_id):
+    venue, shows = await fetch_page(Venue, venue_id)
+    return render_template('pages/show_venue.html', venue=serialize_venue(venue, summarized=False, **shows))
+
+
+@async_view('show_artist')
+async def show_artist(artist_id):
+    artist, shows = await fetch_page(Artist, artist_id)
+    return render_template('pages/show_artist.html', artist=serialize_artist(artist, summarized=False, **shows))
+
+
+async def search_by_name(entity, find):
+    """
+    Search through the worker's search cache, shared with the Flask views.
+    Misses query on a thread, in a copy of the request's context.
+
+    :param entity:
+    :param find:
+    """
+    search_term = request.form.get('search_term', '')
+    results = await asyncio.to_thread(search_cache.get_or_compute, entity, search_term, find)
+    return {'count': len(results), 'data': results}, search_term
+
+
+@async_view('search_venues')
+async def search_venues():
+    response, search_term = await search_by_name('venue', find_venues)
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+
+@async_view('search_artists')
+async def search_artists():
+    response, search_term = await search_by_name('artist', find_artists)
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+
+async def run_lookup(entity, term, limit):
+    statement = search_statement(entity, term, limit, engine.dialect.name)
+    return search_results(entity, await fetch_all(statement))
+
+
+@async_view('search_all')
+async def search_all():
+    search_term = request.args.get('q', '')
+    term = normalize_term(search_term)
+    if not term:
+        return render_template('pages/search.html', results=empty_search(), search_term=search_term)
+
+    tasks = {
+        entity: asyncio.create_task(run_lookup(entity, term, app.config['SEARCH_LIMIT'])) for entity in TYPES
+    }
+    await asyncio.wait(tasks.values(), timeout=app.config['SEARCH_DEADLINE'])
+    results = merge_results(term, tasks)
+    # Unlike threads, late lookups can be stopped, which cancels their query. Wait for them
+    # to unwind so their connections go back to the pool before the request ends.
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return render_template('pages/search.html', results=results, search_term=search_term)
+
+
+def build_environ(scope, body):
+    """
+    WSGI environ of an ASGI HTTP request, for the Flask request context.
+
+    :param scope:
+    :param body:
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def dispatch(view, environ):
+    """
+    Run an async view the way `Flask.wsgi_app` runs a sync one.
+
+    :param view:
+    :param environ:
+    """
+    with app.request_context(environ):
+        try:
+            try:
+                response = app.preprocess_request()
+                if response is None:
+                    response = await view(**request.view_args)
+            except Exception as ex:
+                response = app.handle_user_exception(ex)
+            return app.finalize_request(response)
+        except Exception as ex:
+            return app.handle_exception(ex)
+
+
+def async_endpoint(scope):
+    if scope['type'] != 'http':
+        return None
+    adapter = app.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+    try:
+        endpoint, _ = adapter.match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return None
+    return endpoint if endpoint in ASYNC_VIEWS else None
+
+
+async def application(scope, receive, send):
+    """
+    ASGI entry point: async views for the read-only routes, Flask for the rest.
+
+    :param scope:
+    :param receive:
+    :param send:
+    """
+    if scope['type'] == 'lifespan':
+        while (message := await receive())['type'] != 'lifespan.shutdown':
+            await send({'type': 'lifespan.startup.complete'})
+        await engine.dispose()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+    endpoint = async_endpoint(scope)
+    if endpoint is None:
+        await wsgi_application(scope, receive, send)
+        return
+
+    environ = build_environ(scope, await read_body(receive))
+    response = await dispatch(ASYNC_VIEWS[endpoint], environ)
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()],
+    })
+    try:
+        for chunk in response.iter_encoded():
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        response.close()
+    await send({'type': 'http.response.body', 'body': b''})
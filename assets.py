@@ -0,0 +1,252 @@
+"""Static asset pipeline for `Fyyur` app.
+
+Bundles the stylesheets and scripts used by `layouts/main.html`, writes them
+to `static/dist` under content-hashed names together with `.gz` and `.br`
+variants, and serves them with far-future caching headers.
+
+Building needs `brotli`, `rcssmin` and `rjsmin`; `flask assets build` fails
+without them rather than shipping unminified or uncompressed bundles. Serving
+built bundles doesn't need them.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+DIST_FOLDER = 'dist'
+MANIFEST_FILENAME = 'manifest.json'
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+BUNDLES = {
+    'main.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    'head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    'footer.js': [
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+        'js/script.js',
+    ],
+}
+
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def missing_build_dependencies():
+    return [name for name, module in (('brotli', brotli), ('rcssmin', rcssmin), ('rjsmin', rjsmin)) if module is None]
+
+
+def minify_css(source):
+    return rcssmin.cssmin(source)
+
+
+def minify_js(source):
+    return rjsmin.jsmin(source)
+
+
+def rebase_css_urls(source, relative_path, static_url_path):
+    """
+    Rewrite relative `url()` references so they still resolve from `dist`.
+
+    :param source:
+    :param relative_path:
+    :param static_url_path:
+    """
+    base = os.path.dirname(relative_path)
+
+    def replace(match):
+        target = match.group(2)
+        if target.startswith(('/', 'data:', 'http:', 'https:', '#')):
+            return match.group(0)
+        path, _, suffix = target.partition('?')
+        path, _, fragment = path.partition('#')
+        rebased = os.path.normpath(os.path.join(base, path)).replace(os.sep, '/')
+        rebased = f'{static_url_path}/{rebased}'
+        if suffix:
+            rebased = f'{rebased}?{suffix}'
+        elif fragment:
+            rebased = f'{rebased}#{fragment}'
+        return f'url("{rebased}")'
+
+    return CSS_URL_PATTERN.sub(replace, source)
+
+
+def build_bundle(static_folder, static_url_path, name, sources):
+    """
+    Concatenate and minify the sources of a bundle.
+
+    :param static_folder:
+    :param static_url_path:
+    :param name:
+    :param sources:
+    """
+    chunks = []
+    for relative_path in sources:
+        with open(os.path.join(static_folder, relative_path), encoding='utf-8') as source_file:
+            source = source_file.read()
+        if name.endswith('.css'):
+            chunks.append(minify_css(rebase_css_urls(source, relative_path, static_url_path)))
+        else:
+            chunks.append(minify_js(source))
+    separator = '\n' if name.endswith('.css') else ';\n'
+    return separator.join(chunks).encode('utf-8')
+
+
+def write_bundle(dist_folder, name, content):
+    """
+    Write a bundle under its hashed name together with compressed variants.
+
+    :param dist_folder:
+    :param name:
+    :param content:
+    """
+    stem, extension = os.path.splitext(name)
+    digest = hashlib.md5(content).hexdigest()[:12]
+    hashed_name = f'{stem}.{digest}{extension}'
+    path = os.path.join(dist_folder, hashed_name)
+
+    with open(path, 'wb') as bundle_file:
+        bundle_file.write(content)
+    with open(f'{path}.gz', 'wb') as bundle_file:
+        bundle_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+    with open(f'{path}.br', 'wb') as bundle_file:
+        bundle_file.write(brotli.compress(content, quality=11))
+
+    return hashed_name
+
+
+def build_assets(app):
+    """
+    Build every bundle and write the manifest used by `url_for`.
+
+    :param app:
+    """
+    missing = missing_build_dependencies()
+    if missing:
+        raise RuntimeError(f'Building assets requires {", ".join(missing)}; install requirements.txt.')
+
+    dist_folder = os.path.join(app.static_folder, DIST_FOLDER)
+    os.makedirs(dist_folder, exist_ok=True)
+
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        content = build_bundle(app.static_folder, app.static_url_path, name, sources)
+        manifest[f'{DIST_FOLDER}/{name}'] = f'{DIST_FOLDER}/{write_bundle(dist_folder, name, content)}'
+
+    with open(os.path.join(dist_folder, MANIFEST_FILENAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    app.extensions['assets_manifest'] = manifest
+    return manifest
+
+
+def load_manifest(app):
+    """
+    Load the manifest written by `flask assets build`, if any.
+
+    :param app:
+    """
+    try:
+        with open(os.path.join(app.static_folder, DIST_FOLDER, MANIFEST_FILENAME)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def register_assets(app):
+    """
+    Wire the asset manifest, `dist` view and `assets` command into the app.
+
+    :param app:
+    """
+    app.extensions['assets_manifest'] = load_manifest(app)
+
+    @app.url_defaults
+    def hashed_static_filename(endpoint, values):
+        """
+        Resolve `url_for('static', filename=...)` to the hashed bundle name.
+        """
+        if endpoint == 'static' and 'filename' in values:
+            manifest = app.extensions['assets_manifest']
+            values['filename'] = manifest.get(values['filename'], values['filename'])
+
+    def bundle_urls(name):
+        """
+        URLs to include for a bundle: the hashed bundle once it is built,
+        the individual source files otherwise.
+
+        :param name:
+        """
+        bundle = f'{DIST_FOLDER}/{name}'
+        if bundle in app.extensions['assets_manifest']:
+            return [url_for('static', filename=bundle)]
+        return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+    app.jinja_env.globals['bundle_urls'] = bundle_urls
+
+    @app.route(f'{app.static_url_path}/{DIST_FOLDER}/<path:filename>')
+    def dist_asset(filename):
+        """
+        Controller to serve hashed bundles, precompressed when accepted.
+
+        :param filename:
+        """
+        dist_folder = os.path.join(app.static_folder, DIST_FOLDER)
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        encoding = None
+        for candidate, extension in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and \
+                    os.path.isfile(os.path.join(dist_folder, filename + extension)):
+                encoding = candidate
+                filename = filename + extension
+                break
+
+        response = send_from_directory(dist_folder, filename, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+
+    @app.cli.group()
+    def assets():
+        """Static asset commands."""
+
+    @assets.command('build')
+    def build_command():
+        """Minify, bundle, fingerprint and precompress static assets."""
+        try:
+            manifest = build_assets(app)
+        except RuntimeError as ex:
+            raise click.ClickException(str(ex))
+        for name, hashed_name in sorted(manifest.items()):
+            click.echo(f'{name} -> {hashed_name}')
@@ -0,0 +1,166 @@
+"""iCalendar feeds for `Fyyur` app.
+
+`/venues/<id>/calendar.ics` and `/artists/<id>/calendar.ics` list the shows
+of a venue or an artist from `CALENDAR_PAST_DAYS` ago onwards. The feed is
+streamed straight from a range query on the `(venue_id, start_time)` or
+`(artist_id, start_time)` index, `YIELD_PER` shows at a time.
+
+The `ETag` is derived from the number of shows in the feed and their newest
+`updated_at`, so any insert, update or delete changes it, and from the sum of
+the `version`s of the artists or venues they are joined to, so renaming one of
+those or moving a venue does too. Calendar clients polling with
+`If-None-Match` get a `304` after a single aggregate query on that same index.
+"""
+
+import hashlib
+from datetime import date, datetime, time, timedelta, timezone
+
+from flask import Response, current_app, request, stream_with_context, url_for
+
+from config import db
+from models import Venue, Artist, Show
+
+YIELD_PER = 1000
+SHOW_DURATION = 'PT3H'
+LINE_LENGTH = 75
+
+# model -> (foreign key of its shows, other side of the show, other side's foreign key)
+FEEDS = {
+    Venue: (Show.venue_id, Artist, Show.artist_id),
+    Artist: (Show.artist_id, Venue, Show.venue_id),
+}
+
+
+def escape_text(value):
+    """
+    Escape a TEXT property value, RFC 5545 section 3.3.11.
+
+    :param value:
+    """
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    """
+    Fold a content line into CRLF-terminated lines of at most 75 octets.
+
+    :param line:
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= LINE_LENGTH:
+        return line + '\r\n'
+    parts, start, limit = [], 0, LINE_LENGTH
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multi-byte character.
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, LINE_LENGTH - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_timestamp(value):
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def feed_start():
+    # Day granularity, so the feed and its ETag change once a day as old shows drop out.
+    return datetime.combine(date.today() - timedelta(days=current_app.config['CALENDAR_PAST_DAYS']), time.min)
+
+
+def feed_etag(entity, foreign_key, since):
+    """
+    ETag of an entity's feed, from its shows' count and newest change, and
+    the versions of their artists in a venue's feed, or venues in an artist's.
+
+    Versions only grow, so their sum changes whenever any of those rows is
+    edited, where the largest one may not.
+
+    :param entity:
+    :param foreign_key:
+    :param since:
+    """
+    _, other_model, other_foreign_key = FEEDS[type(entity)]
+    count, updated_at, other_versions = db.session.execute(
+        db.select(db.func.count(Show.id), db.func.max(Show.updated_at), db.func.sum(other_model.version))
+        .join(other_model, other_foreign_key == other_model.id)
+        .where(foreign_key == entity.id, Show.start_time >= since)
+    ).one()
+    version = f'{entity.__tablename__}:{entity.id}:{entity.name}:{since.date()}:{count}:{updated_at}:{other_versions}'
+    if isinstance(entity, Venue):
+        version += f':{entity.address}:{entity.city}:{entity.state}'
+    return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+
+def generate_feed(entity, foreign_key, since):
+    """
+    Yield the iCalendar document of an entity's shows, one chunk per batch.
+
+    :param entity:
+    :param foreign_key:
+    :param since:
+    """
+    yield ''.join(map(fold, (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Fyyur//Shows//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(entity.name)}',
+    )))
+
+    result = db.session.execute(
+        db.select(
+            Show.id, Show.start_time, Show.updated_at, Show.artist_id,
+            Artist.name.label('artist_name'), Venue.name.label('venue_name'),
+            Venue.address, Venue.city, Venue.state
+        )
+        .join(Artist, Show.artist_id == Artist.id)
+        .join(Venue, Show.venue_id == Venue.id)
+        .where(foreign_key == entity.id, Show.start_time >= since)
+        .order_by(Show.start_time, Show.id)
+        .execution_options(yield_per=YIELD_PER)
+    )
+    host = request.host
+    for rows in result.partitions():
+        yield ''.join(''.join(map(fold, (
+            'BEGIN:VEVENT',
+            f'UID:show-{row.id}@{host}',
+            f'DTSTAMP:{format_timestamp(row.updated_at)}',
+            f'LAST-MODIFIED:{format_timestamp(row.updated_at)}',
+            # Show times are stored without a zone: floating local time.
+            f'DTSTART:{row.start_time.strftime("%Y%m%dT%H%M%S")}',
+            f'DURATION:{SHOW_DURATION}',
+            f'SUMMARY:{escape_text(f"{row.artist_name} at {row.venue_name}")}',
+            f'LOCATION:{escape_text(", ".join(filter(None, (row.venue_name, row.address, row.city, row.state))))}',
+            f'URL:{url_for("show_artist", artist_id=row.artist_id, _external=True)}',
+            'END:VEVENT',
+        ))) for row in rows)
+
+    yield fold('END:VCALENDAR')
+
+
+def calendar_response(entity):
+    """
+    Streamed iCalendar feed of a venue or an artist, or `304` when the
+    client's copy is current.
+
+    :param entity:
+    """
+    foreign_key = FEEDS[type(entity)][0]
+    since = feed_start()
+    etag = feed_etag(entity, foreign_key, since)
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(
+            stream_with_context(generate_feed(entity, foreign_key, since)), mimetype='text/calendar'
+        )
+        response.headers['Content-Disposition'] = f'inline; filename="{type(entity).__name__.lower()}-{entity.id}.ics"'
+    response.set_etag(etag)
+    # Clients may keep the feed but must revalidate it on every poll.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -11,8 +11,49 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 # Enable debug mode.
 DEBUG = True
 
+# Opt-in request profiling, see `profiling.py`.
+PROFILING_ENABLED = os.environ.get('FYYUR_PROFILING') == '1'
+PROFILING_SECRET = os.environ.get('FYYUR_PROFILING_SECRET')
+PROFILING_SAMPLE_RATE = float(os.environ.get('FYYUR_PROFILING_SAMPLE_RATE', 0))
+PROFILING_MODE = os.environ.get('FYYUR_PROFILING_MODE', 'cprofile')
+PROFILING_DIR = os.path.join(basedir, 'profiles')
+
+# Stamp deleted venues and artists with `deleted_at` instead of removing them.
+SOFT_DELETE = os.environ.get('FYYUR_SOFT_DELETE') == '1'
+
+# Stream the listing pages instead of rendering them in one go.
+STREAM_LISTINGS = os.environ.get('FYYUR_STREAM_LISTINGS') == '1'
+STREAM_BUFFER_SIZE = 16 * 1024
+
+# Per-worker search result cache, see `search_cache.py`.
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 60
+
+# Unified `/search`, see `search.py`: results per type, seconds per lookup.
+SEARCH_LIMIT = 20
+SEARCH_DEADLINE = float(os.environ.get('FYYUR_SEARCH_DEADLINE', 0.5))
+SEARCH_WORKERS = 8
+
+# In-memory show timeline, see `timeline.py`: seconds between change checks and full rebuilds.
+SHOW_TIMELINE = os.environ.get('FYYUR_SHOW_TIMELINE') == '1'
+SHOW_TIMELINE_REFRESH = 5
+SHOW_TIMELINE_REBUILD = 600
+
+# Shows older than this are left out of the calendar feeds, see `calendar_feeds.py`.
+CALENDAR_PAST_DAYS = 90
+
+# Compiled templates shared by every worker, see `template_cache.py`.
+TEMPLATE_CACHE_DIR = os.environ.get('FYYUR_TEMPLATE_CACHE_DIR', os.path.join(basedir, 'template_cache'))
+
+# Prometheus metrics at `/metrics`, see `metrics.py`.
+METRICS_ENABLED = os.environ.get('FYYUR_METRICS', '1') == '1'
+
+# Async read path, see `asgi.py`. Defaults to the database URL below with an async driver.
+ASYNC_DATABASE_URI = os.environ.get('FYYUR_ASYNC_DATABASE_URL')
+ASYNC_WSGI_THREADS = 10
+
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgres+psycopg2://safiullah:@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('FYYUR_DATABASE_URL', 'postgres+psycopg2://safiullah:@localhost:5432/fyyur')
 
 app = Flask(__name__)
 moment = Moment(app)
@@ -0,0 +1,98 @@
+"""Materialized show counters for `Fyyur` app.
+
+`Venue.num_upcoming_shows`/`num_past_shows` and their `Artist` counterparts
+are kept up to date by the `Show` mapper events in `models.py`. As time
+passes, shows move from upcoming to past; `flask counters rollover` should be
+run periodically (e.g. from cron, more often than `--window`) to recount the
+venues and artists whose shows started recently, and `flask counters repair`
+recomputes every counter in bulk.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+
+from config import db
+from models import Venue, Artist, Show
+
+COUNTED_MODELS = ((Artist, Show.artist_id), (Venue, Show.venue_id))
+
+
+def count_shows(foreign_key, model, *criteria):
+    """
+    Correlated subquery counting the live shows of each `model` row.
+
+    :param foreign_key:
+    :param model:
+    :param criteria:
+    """
+    return db.select(db.func.count(Show.id)) \
+        .where(foreign_key == model.id, Show.deleted_at.is_(None), *criteria).scalar_subquery()
+
+
+def recompute_counters(model, foreign_key, ids=None):
+    """
+    Recompute counters with a single set-based UPDATE, optionally limited to `ids`.
+
+    :param model:
+    :param foreign_key:
+    :param ids=None:
+    """
+    now = datetime.now()
+    statement = db.update(model).values(
+        num_upcoming_shows=count_shows(foreign_key, model, Show.start_time >= now),
+        num_past_shows=count_shows(foreign_key, model, Show.start_time < now),
+    ).execution_options(synchronize_session=False)
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    return db.session.execute(statement).rowcount
+
+
+def repair_counters():
+    """
+    Recompute every venue and artist counter.
+    """
+    updated = {model.__tablename__: recompute_counters(model, foreign_key) for model, foreign_key in COUNTED_MODELS}
+    db.session.commit()
+    return updated
+
+
+def rollover_counters(window):
+    """
+    Recompute counters of venues and artists having shows that started within `window`.
+
+    :param window:
+    """
+    now = datetime.now()
+    updated = {}
+    for model, foreign_key in COUNTED_MODELS:
+        ids = db.select(foreign_key).where(
+            Show.start_time >= now - window, Show.start_time < now
+        ).distinct()
+        updated[model.__tablename__] = recompute_counters(model, foreign_key, ids)
+    db.session.commit()
+    return updated
+
+
+def register_counters(app):
+    """
+    Wire the `counters` command into the app.
+
+    :param app:
+    """
+    @app.cli.group()
+    def counters():
+        """Materialized show counter commands."""
+
+    @counters.command('repair')
+    def repair_command():
+        """Recompute every upcoming/past show counter."""
+        for table, count in repair_counters().items():
+            click.echo(f'{table}: {count} rows recomputed')
+
+    @counters.command('rollover')
+    @click.option('--window', default=60, show_default=True, help='Minutes to look back for started shows.')
+    def rollover_command(window):
+        """Move shows that started recently from upcoming to past."""
+        for table, count in rollover_counters(timedelta(minutes=window)).items():
+            click.echo(f'{table}: {count} rows recomputed')
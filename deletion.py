@@ -0,0 +1,60 @@
+"""Venue and artist deletion for `Fyyur` app.
+
+Hard deletes remove the row with a single DELETE and let the database drop
+the related shows through `ON DELETE CASCADE` (on SQLite, foreign keys are
+turned on by `models.enable_sqlite_foreign_keys`). With `SOFT_DELETE` enabled the
+row and its shows are stamped with `deleted_at` instead, which hides them from
+every ORM query (see `models.hide_soft_deleted`). Either way the show counters
+of the other side of the affected shows are recomputed in bulk.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+
+from config import db
+from counters import recompute_counters
+from models import Venue, Artist, Show
+from search_cache import ENTITIES, queue_invalidation
+
+# model -> (foreign key of its shows, other side of the show, other side's foreign key)
+RELATED_SHOWS = {
+    Venue: (Show.venue_id, Artist, Show.artist_id),
+    Artist: (Show.artist_id, Venue, Show.venue_id),
+}
+
+
+def delete_entity(model, id):
+    """
+    Delete a venue or an artist along with its shows.
+
+    Returns whether a row was deleted; the caller commits.
+
+    :param model:
+    :param id:
+    """
+    foreign_key, other_model, other_foreign_key = RELATED_SHOWS[model]
+    other_ids = db.session.scalars(
+        db.select(other_foreign_key).where(foreign_key == id).distinct()
+    ).all()
+
+    if current_app.config.get('SOFT_DELETE'):
+        now = datetime.now()
+        deleted = db.session.execute(
+            db.update(model).where(model.id == id, model.deleted_at.is_(None))
+            .values(deleted_at=now).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.execute(
+            db.update(Show).where(foreign_key == id, Show.deleted_at.is_(None))
+            .values(deleted_at=now).execution_options(synchronize_session=False)
+        )
+    else:
+        deleted = db.session.execute(
+            db.delete(model).where(model.id == id).execution_options(synchronize_session=False)
+        ).rowcount
+
+    if deleted:
+        queue_invalidation(db.session(), ENTITIES[model])
+    if deleted and other_ids:
+        recompute_counters(other_model, other_foreign_key, other_ids)
+    return bool(deleted)
@@ -0,0 +1,273 @@
+"""Partial venue and artist updates for `Fyyur` app.
+
+The edit forms carry the row's `version` and a signed snapshot of the values
+they were rendered with. A submission is compared against that snapshot and
+only the columns that differ are written, in a single UPDATE that checks and
+bumps the version:
+
+    UPDATE "Venue" SET name=?, version=version + 1
+    WHERE id=? AND version=? AND deleted_at IS NULL
+
+A form submitted unchanged doesn't touch the database at all. If the row was
+edited in the meantime, the UPDATE matches nothing and the edit is reported as
+a conflict instead of overwriting the other change. Snapshots are signed with
+`SECRET_KEY`; one that doesn't verify, e.g. rendered by a worker with another
+key, falls back to comparing against the row read from the database.
+
+`PATCH /venues` and `PATCH /artists` apply partial updates to many rows in one
+transaction, reading the current values of all of them in one query.
+"""
+
+from flask import current_app
+from itsdangerous import BadData, URLSafeSerializer
+
+from config import db
+from models import Venue, Artist
+from search_cache import ENTITIES, queue_invalidation
+
+SNAPSHOT_SALT = 'fyyur-edit-snapshot'
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+CONFLICT = 'conflict'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+# model -> columns rendered by its edit form
+FORM_FIELDS = {
+    Venue: (
+        'name', 'city', 'state', 'address', 'phone', 'genres', 'facebook_link', 'website',
+        'seeking_talent', 'seeking_description'
+    ),
+    Artist: (
+        'name', 'city', 'state', 'phone', 'genres', 'facebook_link', 'website',
+        'seeking_venue', 'seeking_description'
+    ),
+}
+# model -> columns a PATCH may set
+EDITABLE_FIELDS = {model: fields + ('image_link',) for model, fields in FORM_FIELDS.items()}
+BOOLEAN_FIELDS = {'seeking_talent', 'seeking_venue'}
+
+
+def normalize(field, value):
+    """
+    Canonical value of a column, so that equal values compare equal: genres
+    as a sorted comma-separated string and empty strings as `None`.
+
+    :param field:
+    :param value:
+    """
+    if field in BOOLEAN_FIELDS:
+        if value is None:
+            return False
+        if not isinstance(value, bool):
+            raise ValueError(f'`{field}` must be a boolean.')
+        return value
+    if field == 'genres' and isinstance(value, str):
+        value = value.split(',')
+    if field == 'genres' and isinstance(value, (list, tuple)):
+        if not all(isinstance(genre, str) for genre in value):
+            raise ValueError('`genres` must be a list of strings.')
+        # Forms post genres in choice order; sort them so the same set compares equal.
+        value = ','.join(sorted({genre.strip() for genre in value} - {''}))
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'`{field}` must be a string.')
+    return value or None
+
+
+def current_values(row, fields):
+    return {field: normalize(field, getattr(row, field)) for field in fields}
+
+
+def form_values(model, form):
+    """
+    Values of the edit form fields of `model` in a submitted form.
+
+    :param model:
+    :param form:
+    """
+    values = {}
+    for field in FORM_FIELDS[model]:
+        if field in BOOLEAN_FIELDS:
+            # Unchecked boxes aren't submitted.
+            values[field] = form.get(field) == 'y'
+        elif field == 'genres':
+            values[field] = normalize(field, form.getlist(field))
+        else:
+            values[field] = normalize(field, form.get(field))
+    return values
+
+
+def form_data(model, entity):
+    """
+    Initial data of the edit form of `entity`.
+
+    :param model:
+    :param entity:
+    """
+    data = current_values(entity, FORM_FIELDS[model])
+    data['genres'] = data['genres'].split(',') if data['genres'] else []
+    return data
+
+
+def snapshot_serializer(model):
+    return URLSafeSerializer(current_app.secret_key, salt=f'{SNAPSHOT_SALT}:{model.__tablename__}')
+
+
+def dump_snapshot(model, entity):
+    """
+    Signed snapshot of the version and form values of `entity`.
+
+    :param model:
+    :param entity:
+    """
+    return snapshot_serializer(model).dumps([entity.id, entity.version, current_values(entity, FORM_FIELDS[model])])
+
+
+def load_snapshot(model, id, token):
+    """
+    `(version, values)` of a snapshot, or `None` if it doesn't verify or is
+    another row's.
+
+    :param model:
+    :param id:
+    :param token:
+    """
+    if not token:
+        return None
+    try:
+        snapshot_id, version, values = snapshot_serializer(model).loads(token)
+    except (BadData, ValueError):
+        return None
+    if snapshot_id != id or set(values) != set(FORM_FIELDS[model]):
+        return None
+    return version, values
+
+
+def load_current(model, ids, fields):
+    """
+    Current `(version, values)` of the live rows among `ids`, by id.
+
+    :param model:
+    :param ids:
+    :param fields:
+    """
+    rows = db.session.execute(
+        db.select(model.id, model.version, *[getattr(model, field) for field in fields]).where(model.id.in_(ids))
+    ).all()
+    return {row.id: (row.version, current_values(row, fields)) for row in rows}
+
+
+def write_changes(model, id, version, changes):
+    """
+    Write `changes` to a row and bump its version, if it is still at
+    `version`. Returns whether it was.
+
+    :param model:
+    :param id:
+    :param version:
+    :param changes:
+    """
+    return db.session.execute(
+        db.update(model).where(model.id == id, model.version == version, model.deleted_at.is_(None))
+        .values(**changes, version=model.version + 1).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def update_entity(model, id, version, submitted, original=None):
+    """
+    Write the columns of `submitted` that differ from `original`, the values
+    the edit started from at `version`.
+
+    Without `original`, the current row is read and compared instead; a
+    `version` of `None` then accepts whichever version it is at. Returns
+    `(status, changes)`; the caller commits.
+
+    :param model:
+    :param id:
+    :param version:
+    :param submitted:
+    :param original=None:
+    """
+    if original is None:
+        current = load_current(model, [id], submitted).get(id)
+        if current is None:
+            return NOT_FOUND, {}
+        current_version, original = current
+        if version is not None and version != current_version:
+            return CONFLICT, {}
+        version = current_version
+
+    changes = {field: value for field, value in submitted.items() if original.get(field) != value}
+    if not changes:
+        return UNCHANGED, changes
+
+    if not write_changes(model, id, version, changes):
+        exists = db.session.scalar(db.select(model.id).where(model.id == id)) is not None
+        return (CONFLICT if exists else NOT_FOUND), changes
+
+    # Core updates skip the mapper events the search cache listens to.
+    if 'name' in changes:
+        for name in (original.get('name'), changes['name']):
+            queue_invalidation(db.session(), ENTITIES[model], name)
+    return UPDATED, changes
+
+
+def parse_update(model, item):
+    """
+    `(id, version, values)` of a PATCH item.
+
+    :param model:
+    :param item:
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Expected an object.')
+    id, version = item.get('id'), item.get('version')
+    for field, value in (('id', id), ('version', version)):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f'`{field}` must be an integer.')
+    unknown = set(item) - {'id', 'version'} - set(EDITABLE_FIELDS[model])
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}.')
+    return id, version, {
+        field: normalize(field, value) for field, value in item.items() if field not in ('id', 'version')
+    }
+
+
+def update_entities(model, items):
+    """
+    Apply partial updates to many rows of `model`.
+
+    Each item takes the `id` and `version` of a row and the columns to set.
+    Returns one `{id, status, changed, version}` result per item, in order;
+    the caller commits.
+
+    :param model:
+    :param items:
+    """
+    results, updates = [], []
+    for item in items:
+        try:
+            id, version, values = parse_update(model, item)
+        except ValueError as ex:
+            id = item.get('id') if isinstance(item, dict) else None
+            results.append({'id': id, 'status': INVALID, 'error': str(ex)})
+        else:
+            results.append({'id': id})
+            updates.append((results[-1], version, values))
+
+    current = load_current(model, {result['id'] for result, _, _ in updates}, EDITABLE_FIELDS[model])
+    for result, version, values in updates:
+        if result['id'] not in current:
+            result['status'] = NOT_FOUND
+            continue
+        current_version, original = current[result['id']]
+        if version != current_version:
+            result.update(status=CONFLICT, version=current_version)
+            continue
+        status, changes = update_entity(model, result['id'], version, values, original)
+        result.update(status=status, changed=sorted(changes), version=version + (status == UPDATED))
+        if status == UPDATED:
+            # Later items for the same row build on this one.
+            current[result['id']] = (version + 1, {**original, **changes})
+    return results
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, Optional
 
 
 class ShowForm(Form):
@@ -18,6 +18,19 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    repeat = SelectField(
+        'repeat',
+        choices=[
+            ('', 'Does not repeat'),
+            ('weekly', 'Weekly'),
+            ('monthly', 'Monthly'),
+        ]
+    )
+    repeat_until = DateTimeField(
+        'repeat_until',
+        validators=[Optional()],
+        format='%Y-%m-%d'
+    )
 
 
 class VenueForm(Form):
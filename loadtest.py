@@ -0,0 +1,536 @@
+"""Load testing for `Fyyur` app.
+
+`flask loadtest run` serves the app with gunicorn on a free local port and
+replays a mix of listing, search, detail and create requests against it at a
+series of arrival rates, `--duration` seconds each. Arrivals follow an open
+model: requests are sent on a Poisson schedule whether or not earlier ones
+have completed, as independent users would, and latency is measured from the
+scheduled send time, so a server falling behind shows up as growing latency
+rather than as a client that slows down with it.
+
+The mix is either synthesized from `--mix` weights, with ids and search terms
+drawn from the database, or recorded from an access log (`--access-log`),
+whose requests are replayed in their logged proportions. Logs don't record
+request bodies, so logged search and create posts get synthesized forms.
+Creates write to the database: point `FYYUR_DATABASE_URL` at a scratch copy.
+
+Each stage reports throughput, latency percentiles and error rates. The
+saturation point is the highest rate the server kept up with: throughput
+within `THROUGHPUT_RATIO` of the offered rate, p99 latency within `--slo` and
+errors within `--max-error-rate`.
+"""
+
+import http.client
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+import click
+
+from config import db
+from models import Venue, Artist
+
+CATEGORIES = ('listing', 'search', 'detail', 'create')
+DEFAULT_MIX = 'listing=30,search=20,detail=45,create=5'
+DEFAULT_RATES = '5,10,20,40,80'
+PERCENTILES = (50, 90, 95, 99)
+THROUGHPUT_RATIO = 0.9
+# Venues and artists sampled for ids and search terms.
+SAMPLE_SIZE = 1000
+SERVER_START_TIMEOUT = 60
+
+Request = namedtuple('Request', 'category method path form')
+
+# (category, method, path pattern)
+ROUTES = (
+    ('listing', 'GET', re.compile(r'^/(venues|artists|shows)/?$')),
+    ('search', 'GET', re.compile(r'^/search$')),
+    ('search', 'POST', re.compile(r'^/(venues|artists)/search$')),
+    ('detail', 'GET', re.compile(r'^/(venues|artists)/\d+$')),
+    ('create', 'POST', re.compile(r'^/(venues|artists|shows)/create$')),
+)
+# Request line and status of the common and combined log formats, as written
+# by gunicorn, nginx and Apache.
+LOG_LINE = re.compile(r'"(?P<method>[A-Z]+) (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+
+
+def classify(method, path):
+    """
+    Mix category of a request, or `None` for routes outside the mix.
+
+    :param method:
+    :param path:
+    """
+    route = urlsplit(path).path
+    for category, route_method, pattern in ROUTES:
+        if method == route_method and pattern.match(route):
+            return category
+    return None
+
+
+def parse_mix(value):
+    """
+    Category weights of a `listing=30,search=20,...` mix.
+
+    :param value:
+    """
+    weights = {}
+    for part in value.split(','):
+        category, _, weight = part.partition('=')
+        category = category.strip()
+        if category not in CATEGORIES:
+            raise click.BadParameter(f'Unknown category `{category}`, expected one of {", ".join(CATEGORIES)}.')
+        try:
+            weights[category] = float(weight)
+        except ValueError:
+            raise click.BadParameter(f'Invalid weight `{weight}` for `{category}`.')
+    if sum(weights.values()) <= 0:
+        raise click.BadParameter('At least one weight must be positive.')
+    return weights
+
+
+def parse_rates(value):
+    try:
+        rates = [float(rate) for rate in value.split(',')]
+    except ValueError:
+        raise click.BadParameter(f'Invalid rates `{value}`.')
+    if not rates or min(rates) <= 0:
+        raise click.BadParameter('Rates must be positive.')
+    return sorted(rates)
+
+
+def read_access_log(path):
+    """
+    `(method, path, category)` of every replayable request in an access log,
+    and the number of lines skipped.
+
+    GET requests are replayed as logged; posts only for the routes whose form
+    can be synthesized.
+
+    :param path:
+    """
+    entries, skipped = [], 0
+    with open(path, encoding='utf-8', errors='replace') as log:
+        for line in log:
+            match = LOG_LINE.search(line)
+            if match is None:
+                skipped += 1
+                continue
+            method, target = match['method'], match['path']
+            category = classify(method, target)
+            if method != 'GET' and category not in ('search', 'create'):
+                skipped += 1
+                continue
+            entries.append((method, target, category or 'other'))
+    return entries, skipped
+
+
+def load_targets():
+    """
+    Venue and artist ids, and search terms from their names, sampled from
+    the database.
+    """
+    targets = {'terms': set()}
+    for model in (Venue, Artist):
+        rows = db.session.execute(
+            db.select(model.id, model.name).order_by(db.func.random()).limit(SAMPLE_SIZE)
+        ).all()
+        if not rows:
+            raise click.ClickException(f'No {model.__tablename__} rows to send requests for.')
+        targets[f'{model.__tablename__.lower()}s'] = [row.id for row in rows]
+        targets['terms'].update(word for row in rows for word in (row.name or '').split() if len(word) > 2)
+    targets['terms'] = sorted(targets['terms']) or ['a']
+    return targets
+
+
+def synthesize(category, targets, rng, path=None):
+    """
+    A request of `category` against random targets, to `path` if given.
+
+    :param category:
+    :param targets:
+    :param rng:
+    :param path=None:
+    """
+    if category == 'listing':
+        return Request(category, 'GET', path or rng.choice(('/venues', '/artists', '/shows')), None)
+    if category == 'detail':
+        kind = rng.choice(('venues', 'artists'))
+        return Request(category, 'GET', f'/{kind}/{rng.choice(targets[kind])}', None)
+    if category == 'search':
+        term = rng.choice(targets['terms'])
+        path = path or rng.choice(('/search', '/venues/search', '/artists/search'))
+        if path == '/search':
+            return Request(category, 'GET', f'/search?{urlencode({"q": term})}', None)
+        return Request(category, 'POST', path, {'search_term': term})
+
+    path = path or rng.choice(('/venues/create', '/artists/create', '/shows/create'))
+    if path == '/shows/create':
+        # Minute resolution keeps double bookings, which are rejected, rare.
+        start_time = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=rng.randrange(1, 525600))
+        return Request(category, 'POST', path, {
+            'artist_id': rng.choice(targets['artists']),
+            'venue_id': rng.choice(targets['venues']),
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    form = {
+        'name': f'Load test {rng.getrandbits(32):08x}',
+        'city': 'San Francisco',
+        'state': 'CA',
+        'phone': '555-555-5555',
+        'genres': 'Jazz',
+    }
+    if path == '/venues/create':
+        form['address'] = '1 Load Test Street'
+    return Request(category, 'POST', path, form)
+
+
+def request_source(targets, weights=None, entries=None):
+    """
+    Function drawing the next request of the mix from a random generator.
+
+    :param targets:
+    :param weights=None: category weights of a synthesized mix
+    :param entries=None: `read_access_log` entries of a recorded mix
+    """
+    if entries:
+        def next_request(rng):
+            method, path, category = rng.choice(entries)
+            if method == 'GET':
+                return Request(category, method, path, None)
+            return synthesize(category, targets, rng, path)
+        return next_request
+
+    categories, cumulative = list(weights), []
+    for weight in weights.values():
+        cumulative.append((cumulative[-1] if cumulative else 0) + weight)
+
+    def next_request(rng):
+        category = rng.choices(categories, cum_weights=cumulative)[0]
+        return synthesize(category, targets, rng)
+    return next_request
+
+
+def arrival_times(rate, duration, rng, poisson=True):
+    """
+    Send offsets, in seconds, of an open-model stage.
+
+    :param rate: mean requests per second
+    :param duration:
+    :param rng:
+    :param poisson=True: exponential gaps, otherwise evenly spaced
+    """
+    times, offset = [], 0.0
+    while True:
+        offset += rng.expovariate(rate) if poisson else 1 / rate
+        if offset >= duration:
+            return times
+        times.append(offset)
+
+
+def send(url, request, timeout):
+    """
+    Send a request on a new connection and read its response. Returns the
+    status code.
+
+    :param url: split base URL of the server
+    :param request:
+    :param timeout:
+    """
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+    try:
+        headers = {'Connection': 'close'}
+        body = None
+        if request.form is not None:
+            body = urlencode(request.form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(request.method, url.path.rstrip('/') + request.path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def issue(url, request, scheduled_at, timeout, results):
+    try:
+        status = send(url, request, timeout)
+        error = f'HTTP {status}' if status >= 400 else None
+    except TimeoutError:
+        error = 'timeout'
+    except (OSError, http.client.HTTPException) as ex:
+        error = type(ex).__name__
+    # Measured from the scheduled send time, so time spent queued counts.
+    results.append((request.category, time.perf_counter() - scheduled_at, error))
+
+
+def percentile(ordered, p):
+    """
+    Nearest-rank percentile of sorted values.
+
+    :param ordered:
+    :param p:
+    """
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(results):
+    """
+    Request count, latency percentiles and errors of `(category, latency,
+    error)` results.
+
+    :param results:
+    """
+    latencies = sorted(latency for _, latency, _ in results)
+    errors = Counter(error for _, _, error in results if error)
+    summary = {
+        'requests': len(results),
+        'errors': dict(errors),
+        'error_rate': sum(errors.values()) / len(results) if results else 0.0,
+        'latency': {f'p{p}': percentile(latencies, p) for p in PERCENTILES},
+    }
+    summary['latency']['max'] = latencies[-1] if latencies else None
+    return summary
+
+
+def run_stage(url, next_request, rate, duration, rng, timeout, concurrency, poisson=True):
+    """
+    Send requests at `rate` per second for `duration` seconds and wait for
+    them to complete.
+
+    :param url: split base URL of the server
+    :param next_request:
+    :param rate:
+    :param duration:
+    :param rng:
+    :param timeout:
+    :param concurrency: requests in flight at most; later arrivals queue
+    :param poisson=True:
+    """
+    schedule = [(offset, next_request(rng)) for offset in arrival_times(rate, duration, rng, poisson)]
+    results, lag = [], 0.0
+    executor = ThreadPoolExecutor(concurrency, thread_name_prefix='loadtest')
+    started_at = time.perf_counter()
+    for offset, request in schedule:
+        scheduled_at = started_at + offset
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            lag = max(lag, -delay)
+        executor.submit(issue, url, request, scheduled_at, timeout, results)
+    executor.shutdown(wait=True)
+    elapsed = time.perf_counter() - started_at
+
+    stage = {'rate': rate, 'duration': duration, 'elapsed': elapsed, **summarize(results)}
+    # Poisson arrivals only average `rate`; the server is judged on what was sent.
+    stage['offered'] = len(schedule) / duration
+    ok = stage['requests'] - sum(stage['errors'].values())
+    stage['throughput'] = ok / elapsed if elapsed else 0.0
+    # A generator running late means the host, not the server, limited the rate.
+    stage['dispatch_lag'] = lag
+    stage['categories'] = {
+        category: summarize([result for result in results if result[0] == category])
+        for category in sorted({result[0] for result in results})
+    }
+    return stage
+
+
+def check_stage(stage, slo, max_error_rate):
+    """
+    Reasons a stage missed its targets; empty if the server kept up.
+
+    :param stage:
+    :param slo:
+    :param max_error_rate:
+    """
+    reasons = []
+    if stage['throughput'] < THROUGHPUT_RATIO * stage['offered']:
+        reasons.append(
+            f'throughput {stage["throughput"]:.1f}/s < {THROUGHPUT_RATIO:.0%} of {stage["offered"]:.1f}/s sent'
+        )
+    p99 = stage['latency']['p99']
+    if p99 is not None and p99 > slo:
+        reasons.append(f'p99 {p99 * 1000:.0f} ms > {slo * 1000:.0f} ms')
+    if stage['error_rate'] > max_error_rate:
+        reasons.append(f'errors {stage["error_rate"]:.1%} > {max_error_rate:.1%}')
+    return reasons
+
+
+def format_ms(value):
+    return '-' if value is None else f'{value * 1000:.0f}'
+
+
+def format_row(label, count, throughput, summary):
+    latency = summary['latency']
+    return (
+        f'{label:>10} {count:>7} {throughput:>8} '
+        + ' '.join(f'{format_ms(latency[key]):>7}' for key in ('p50', 'p90', 'p99', 'max'))
+        + f' {summary["error_rate"]:>7.1%}'
+    )
+
+
+def wait_until_ready(url, process, timeout=SERVER_START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException(f'gunicorn exited with status {process.returncode}.')
+        try:
+            send(url, Request('other', 'GET', '/', None), timeout=5)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise click.ClickException(f'gunicorn didn\'t start within {timeout} seconds.')
+
+
+@contextmanager
+def serve(root_path, workers, threads, access_log=None, server_log=None):
+    """
+    Serve the app with gunicorn on a free local port, yielding its split URL.
+
+    :param root_path:
+    :param workers:
+    :param threads:
+    :param access_log=None: file gunicorn writes its access log to
+    :param server_log=None: file gunicorn's output goes to
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app', '--chdir', root_path, '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--threads', str(threads), '--worker-class', 'gthread',
+    ]
+    if access_log:
+        command += ['--access-logfile', access_log]
+    with open(server_log or os.devnull, 'ab') as output:
+        process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT)
+    try:
+        url = urlsplit(f'http://127.0.0.1:{port}')
+        wait_until_ready(url, process)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def register_loadtest(app):
+    """
+    Wire the `loadtest` command into the app.
+
+    :param app:
+    """
+    @app.cli.group()
+    def loadtest():
+        """Load testing commands."""
+
+    @loadtest.command('run')
+    @click.option('--rates', default=DEFAULT_RATES, show_default=True, help='Arrival rates to step through.')
+    @click.option('--duration', default=30.0, show_default=True, help='Seconds per rate.')
+    @click.option('--warmup', default=5.0, show_default=True, help='Seconds at the lowest rate before measuring.')
+    @click.option('--mix', default=DEFAULT_MIX, show_default=True, help='Category weights of a synthesized mix.')
+    @click.option('--access-log', type=click.Path(exists=True, dir_okay=False), help='Replay the mix of this log.')
+    @click.option('--url', help='Test a running server instead of starting gunicorn.')
+    @click.option('--workers', default=2, show_default=True, help='gunicorn worker processes.')
+    @click.option('--threads', default=4, show_default=True, help='Threads per gunicorn worker.')
+    @click.option('--server-log', type=click.Path(dir_okay=False), help='File for gunicorn\'s output.')
+    @click.option('--record-log', type=click.Path(dir_okay=False), help='File for gunicorn\'s access log.')
+    @click.option('--slo', default=1.0, show_default=True, help='p99 latency target, in seconds.')
+    @click.option('--max-error-rate', default=0.01, show_default=True, help='Highest acceptable error rate.')
+    @click.option('--timeout', default=10.0, show_default=True, help='Seconds before a request fails.')
+    @click.option('--concurrency', default=512, show_default=True, help='Requests in flight at most.')
+    @click.option('--uniform', is_flag=True, help='Evenly spaced arrivals instead of Poisson.')
+    @click.option('--keep-going', is_flag=True, help='Run every rate, even past the saturation point.')
+    @click.option('--seed', type=int, help='Random seed, for repeatable runs.')
+    @click.option('--json', 'json_path', type=click.Path(dir_okay=False), help='Write the results to this file.')
+    def run_command(rates, duration, warmup, mix, access_log, url, workers, threads, server_log, record_log,
+                    slo, max_error_rate, timeout, concurrency, uniform, keep_going, seed, json_path):
+        """Replay a traffic mix at increasing rates and find the saturation point."""
+        rates = parse_rates(rates)
+        rng = random.Random(seed)
+        targets = load_targets()
+        if access_log:
+            entries, skipped = read_access_log(access_log)
+            if not entries:
+                raise click.ClickException(f'No replayable requests in {access_log}.')
+            click.echo(f'Replaying {len(entries)} logged requests ({skipped} lines skipped)')
+            next_request = request_source(targets, entries=entries)
+        else:
+            next_request = request_source(targets, weights=parse_mix(mix))
+        db.session.remove()
+
+        stages, saturation = [], None
+        server = nullcontext(urlsplit(url)) if url else serve(app.root_path, workers, threads, record_log, server_log)
+        with server as base:
+            click.echo(f'Testing {base.geturl()}')
+            if warmup:
+                run_stage(base, next_request, rates[0], warmup, rng, timeout, concurrency, not uniform)
+            click.echo(f'{"rate/s":>10} {"sent":>7} {"ok/s":>8} {"p50 ms":>7} {"p90 ms":>7} '
+                       f'{"p99 ms":>7} {"max ms":>7} {"errors":>7}')
+            for rate in rates:
+                stage = run_stage(base, next_request, rate, duration, rng, timeout, concurrency, not uniform)
+                stage['missed'] = check_stage(stage, slo, max_error_rate)
+                stages.append(stage)
+                click.echo(format_row(f'{rate:g}', stage['requests'], f'{stage["throughput"]:.1f}', stage))
+                for category, summary in stage['categories'].items():
+                    click.echo(format_row(category, summary['requests'], '', summary))
+                for error, count in sorted(stage['errors'].items()):
+                    click.echo(f'{"":>10} {count:>7} {error}')
+                if stage['dispatch_lag'] > 0.05:
+                    click.echo(f'{"":>10} the generator ran up to {stage["dispatch_lag"] * 1000:.0f} ms late; '
+                               'the client host may be the bottleneck')
+                if stage['missed'] and saturation is None:
+                    saturation = stage
+                    if not keep_going:
+                        break
+
+        # The highest rate kept up with below the first one that wasn't.
+        sustained = [
+            stage['rate'] for stage in stages
+            if not stage['missed'] and (saturation is None or stage['rate'] < saturation['rate'])
+        ]
+        saturation_rate = max(sustained) if sustained else None
+        if saturation is None:
+            click.echo(f'No saturation up to {rates[-1]:g} req/s.')
+        elif saturation_rate is not None:
+            click.echo(f'Saturation point: {saturation_rate:g} req/s, missed at {saturation["rate"]:g} req/s '
+                       f'({"; ".join(saturation["missed"])}).')
+        else:
+            click.echo(f'Saturated below {saturation["rate"]:g} req/s ({"; ".join(saturation["missed"])}).')
+
+        if json_path:
+            with open(json_path, 'w') as output:
+                json.dump({
+                    'stages': stages,
+                    'saturation_rate': saturation_rate if saturation is not None else None,
+                    'slo': slo,
+                    'max_error_rate': max_error_rate,
+                }, output, indent=2)
+
+    @loadtest.command('mix')
+    @click.argument('access_log', type=click.Path(exists=True, dir_okay=False))
+    def mix_command(access_log):
+        """Show the traffic mix recorded in an access log."""
+        entries, skipped = read_access_log(access_log)
+        click.echo(f'{len(entries)} replayable requests, {skipped} lines skipped')
+        for category, count in Counter(category for _, _, category in entries).most_common():
+            click.echo(f'{category:>10} {count:>8} {count / len(entries):>7.1%}')
+        routes = Counter((method, urlsplit(path).path) for method, path, _ in entries)
+        for (method, path), count in routes.most_common(10):
+            click.echo(f'{"":>10} {count:>8} {method} {path}')
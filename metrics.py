@@ -0,0 +1,160 @@
+"""Prometheus metrics for `Fyyur` app.
+
+Exposes, at `/metrics`:
+
+* `fyyur_request_duration_seconds`, a latency histogram per endpoint;
+* `fyyur_requests_total`, responses per endpoint and status code;
+* `fyyur_db_query_duration_seconds`, a query time histogram per statement type;
+* `fyyur_template_render_duration_seconds`, a render time histogram per template.
+
+With several preforked workers, point `PROMETHEUS_MULTIPROC_DIR` at an empty
+directory before the server starts: every worker then writes its samples to
+memory-mapped files there, and `/metrics` aggregates them.
+"""
+
+import os
+import time
+
+from flask import Response, g, request, before_render_template, template_rendered
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+    'fyyur_request_duration_seconds', 'Request latency by endpoint.',
+    ['method', 'endpoint'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+REQUEST_COUNT = Counter(
+    'fyyur_requests_total', 'Responses by endpoint and status code.',
+    ['method', 'endpoint', 'status']
+)
+DB_QUERY_LATENCY = Histogram(
+    'fyyur_db_query_duration_seconds', 'Database query time by statement type.',
+    ['statement'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5)
+)
+TEMPLATE_RENDER_LATENCY = Histogram(
+    'fyyur_template_render_duration_seconds', 'Template render time by template.',
+    ['template'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5, 30)
+)
+
+STATEMENT_TYPES = {'select', 'insert', 'update', 'delete'}
+
+
+# (metric, label values) -> child; `.labels()` validates and locks on every call.
+LABELLED = {}
+
+
+def labelled(metric, *labels):
+    child = LABELLED.get((metric, labels))
+    if child is None:
+        child = LABELLED[metric, labels] = metric.labels(*labels)
+    return child
+
+
+def endpoint_label():
+    return request.endpoint or 'unmatched'
+
+
+def finish_request(status):
+    """
+    Callable recording the current request's latency and status, or `None`
+    if it was recorded already. It may run after the request context is gone.
+
+    :param status:
+    """
+    started_at = g.pop('metrics_started_at', None)
+    if started_at is None:
+        return None
+    endpoint = endpoint_label()
+    latency = labelled(REQUEST_LATENCY, request.method, endpoint)
+    count = labelled(REQUEST_COUNT, request.method, endpoint, status)
+
+    def observe():
+        latency.observe(time.perf_counter() - started_at)
+        count.inc()
+    return observe
+
+
+def collect():
+    """
+    Metrics in the Prometheus text format, aggregated across workers when
+    running in multiprocess mode.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def register_metrics(app):
+    """
+    Wire request, query and template instrumentation and `/metrics` into the app.
+
+    :param app:
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        observe = finish_request(str(response.status_code))
+        if observe is not None:
+            if response.is_streamed:
+                # Time streamed responses until the last chunk is sent, not the first.
+                response.call_on_close(observe)
+            else:
+                observe()
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error=None):
+        # `after_request` is skipped when a view raises.
+        observe = finish_request('500')
+        if observe is not None:
+            observe()
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started_at', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_started_at'].pop()
+        statement_type = statement.lstrip()[:6].lower()
+        labelled(DB_QUERY_LATENCY, statement_type if statement_type in STATEMENT_TYPES else 'other').observe(elapsed)
+
+    @event.listens_for(Engine, 'handle_error')
+    def discard_query_timer(exception_context):
+        timers = exception_context.connection.info.get('metrics_query_started_at') \
+            if exception_context.connection is not None else None
+        if timers:
+            timers.pop()
+
+    def start_render_timer(sender, template, context, **extra):
+        g.setdefault('metrics_render_started_at', {})[id(context)] = time.perf_counter()
+
+    def record_render(sender, template, context, **extra):
+        started_at = g.get('metrics_render_started_at', {}).pop(id(context), None)
+        if started_at is not None:
+            labelled(TEMPLATE_RENDER_LATENCY, template.name or 'unknown').observe(time.perf_counter() - started_at)
+
+    before_render_template.connect(start_render_timer, app, weak=False)
+    template_rendered.connect(record_render, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        Controller to expose metrics in the Prometheus text format.
+        """
+        return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
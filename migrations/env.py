@@ -1,6 +1,8 @@
 from __future__ import with_statement
 
 import logging
+import os
+import sys
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -17,6 +19,9 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# make `migrations.helpers` importable from revision scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -79,10 +84,18 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Batch mode recreates tables; dropping Venue or Artist with foreign keys on
+            # would cascade to their shows.
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            # Commit each revision, so locks taken by one aren't held through the next.
+            transaction_per_migration=True,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,152 @@
+"""Helpers for migrations that must not lock busy tables.
+
+`add_column_not_null` adds a column in three steps instead of one
+`op.add_column(..., nullable=False)`:
+
+1. add the column as nullable, which only touches the catalog;
+2. backfill it in primary key ranges of `batch_size` rows, each committed on
+   its own and optionally throttled, logging progress as it goes;
+3. only then add the NOT NULL constraint. On PostgreSQL a `NOT VALID` check
+   constraint is validated first, so `SET NOT NULL` doesn't rescan the table
+   under an exclusive lock, and each of these statements commits on its own.
+
+Each step reports how long it held its locks, so slow steps show up in the
+migration log.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_LOCK_TIMEOUT = '5s'
+
+
+@contextmanager
+def timed(description, durations=None):
+    started_at = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started_at
+    if durations is not None:
+        durations.append(elapsed)
+    logger.info(f'{description} took {elapsed * 1000:.1f} ms')
+
+
+def is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def set_lock_timeout(timeout):
+    """
+    Fail fast instead of queueing behind long transactions (PostgreSQL only).
+
+    :param timeout:
+    """
+    if is_postgresql() and timeout:
+        op.execute(f"SET lock_timeout = '{timeout}'")
+
+
+def backfill_column(table_name, column_name, value, batch_size=DEFAULT_BATCH_SIZE, pause=0, pk='id'):
+    """
+    Set `column_name` to `value` where it is NULL, one primary key range at a time.
+
+    Batches run in autocommit mode, each UPDATE in its own transaction, so
+    row locks are held only for the duration of a batch. Returns the
+    per-batch durations in seconds.
+
+    :param table_name:
+    :param column_name:
+    :param value:
+    :param batch_size=DEFAULT_BATCH_SIZE:
+    :param pause=0:
+    :param pk='id':
+    """
+    table = sa.table(table_name, sa.column(pk), sa.column(column_name))
+    update = table.update().where(
+        table.c[pk] >= sa.bindparam('low'), table.c[pk] < sa.bindparam('high'),
+        table.c[column_name].is_(None)
+    ).values({column_name: value})
+
+    if op.get_context().as_sql:
+        op.execute(table.update().where(table.c[column_name].is_(None)).values({column_name: value}))
+        return []
+
+    durations = []
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(sa.select(sa.func.min(table.c[pk]), sa.func.max(table.c[pk]))).one()
+        if low is None:
+            return durations
+        total = high - low + 1
+        for start in range(low, high + 1, batch_size):
+            with timed(f'Backfilling {table_name}.{column_name} [{start}, {start + batch_size})', durations):
+                bind.execute(update, {'low': start, 'high': start + batch_size})
+            done = min(start + batch_size, high + 1) - low
+            logger.info(f'Backfilled {table_name}.{column_name}: {done}/{total} ids ({done * 100 // total}%)')
+            if pause:
+                time.sleep(pause)
+    if durations:
+        logger.info(
+            f'Backfilled {table_name}.{column_name} in {len(durations)} batches, '
+            f'longest batch {max(durations) * 1000:.1f} ms'
+        )
+    return durations
+
+
+def set_not_null(table_name, column_name, existing_type):
+    """
+    Add the NOT NULL constraint once the column is fully backfilled.
+
+    :param table_name:
+    :param column_name:
+    :param existing_type:
+    """
+    if is_postgresql():
+        check = f'{table_name}_{column_name}_not_null'
+        # Each step commits on its own; in one transaction the ACCESS EXCLUSIVE lock
+        # taken by ADD CONSTRAINT would be held through the validation scan.
+        with op.get_context().autocommit_block():
+            with timed(f'Adding NOT VALID check {check}'):
+                op.execute(
+                    f'ALTER TABLE "{table_name}" ADD CONSTRAINT "{check}" '
+                    f'CHECK ("{column_name}" IS NOT NULL) NOT VALID'
+                )
+            # Validation takes a SHARE UPDATE EXCLUSIVE lock: reads and writes go on.
+            with timed(f'Validating check {check}'):
+                op.execute(f'ALTER TABLE "{table_name}" VALIDATE CONSTRAINT "{check}"')
+            # PostgreSQL 12+ uses the validated check to skip the table scan.
+            with timed(f'Altering {table_name}.{column_name} to NOT NULL'):
+                op.alter_column(table_name, column_name, existing_type=existing_type, nullable=False)
+            with timed(f'Dropping check {check}'):
+                op.drop_constraint(check, table_name, type_='check')
+    else:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.alter_column(column_name, existing_type=existing_type, nullable=False)
+
+
+def add_column_not_null(table_name, column, value, batch_size=DEFAULT_BATCH_SIZE, pause=0,
+                        lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    Add a NOT NULL column to a populated table without a long lock.
+
+    :param table_name:
+    :param column: nullable=False `sa.Column` to add
+    :param value: value, or SQL expression, to backfill existing rows with
+    :param batch_size=DEFAULT_BATCH_SIZE:
+    :param pause=0: seconds to sleep between batches
+    :param lock_timeout=DEFAULT_LOCK_TIMEOUT:
+    """
+    set_lock_timeout(lock_timeout)
+    with timed(f'Adding nullable {table_name}.{column.name}'):
+        op.add_column(table_name, sa.Column(column.name, column.type, nullable=True))
+    backfill_column(table_name, column.name, value, batch_size=batch_size, pause=pause)
+    set_lock_timeout(lock_timeout)
+    with timed(f'Setting {table_name}.{column.name} NOT NULL'):
+        set_not_null(table_name, column.name, column.type)
+    if is_postgresql() and lock_timeout:
+        op.execute('RESET lock_timeout')
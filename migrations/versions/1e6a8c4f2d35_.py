@@ -0,0 +1,33 @@
+"""add show updated_at and per-entity start time indexes
+
+Revision ID: 1e6a8c4f2d35
+Revises: 8b2e4d6f1a90
+Create Date: 2026-10-19 21:04:37.519843
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import add_column_not_null
+
+
+# revision identifiers, used by Alembic.
+revision = '1e6a8c4f2d35'
+down_revision = '8b2e4d6f1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing shows count as changed now, which invalidates every feed once.
+    add_column_not_null('Show', sa.Column('updated_at', sa.DateTime(), nullable=False), sa.func.now())
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), server_default=sa.func.now())
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_column('Show', 'updated_at')
@@ -0,0 +1,30 @@
+"""add venue and artist version
+
+Revision ID: 7c4b9e2a6d18
+Revises: 1e6a8c4f2d35
+Create Date: 2026-10-19 23:12:08.406217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import add_column_not_null
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4b9e2a6d18'
+down_revision = '1e6a8c4f2d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ('Venue', 'Artist'):
+        add_column_not_null(table_name, sa.Column('version', sa.Integer(), nullable=False), 1)
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.alter_column('version', existing_type=sa.Integer(), server_default='1')
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
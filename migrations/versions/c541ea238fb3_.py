@@ -8,6 +8,8 @@ Create Date: 2019-12-02 23:14:54.924662
 from alembic import op
 import sqlalchemy as sa
 
+from migrations.helpers import add_column_not_null
+
 
 # revision identifiers, used by Alembic.
 revision = 'c541ea238fb3'
@@ -28,10 +30,10 @@ def upgrade():
     sa.PrimaryKeyConstraint('id')
     )
     op.add_column('Artist', sa.Column('seeking_description', sa.Text(), nullable=True))
-    op.add_column('Artist', sa.Column('seeking_venue', sa.Boolean(), nullable=False))
+    add_column_not_null('Artist', sa.Column('seeking_venue', sa.Boolean(), nullable=False), sa.false())
     op.add_column('Artist', sa.Column('website', sa.String(length=120), nullable=True))
     op.add_column('Venue', sa.Column('seeking_description', sa.Text(), nullable=True))
-    op.add_column('Venue', sa.Column('seeking_talent', sa.Boolean(), nullable=False))
+    add_column_not_null('Venue', sa.Column('seeking_talent', sa.Boolean(), nullable=False), sa.false())
     op.add_column('Venue', sa.Column('website', sa.String(length=120), nullable=True))
     # ### end Alembic commands ###
 
@@ -1,7 +1,13 @@
 """`Models` module for `Fyyur` app"""
 
+import sqlite3
 from datetime import datetime
 
+import dateutil.parser
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, validates, with_loader_criteria
+
 from config import db
 
 DATETIME_FORMAT = '%b %d %Y %H:%M:%S'
@@ -22,8 +28,14 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False, nullable=False)
     seeking_description = db.Column(db.Text, nullable=True)
+    num_upcoming_shows = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
+    num_past_shows = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
+
+    shows = db.relationship('Show', backref='venue', lazy=True, passive_deletes=True)
 
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Venue {self.id} {self.name}>'
@@ -61,8 +73,14 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False, nullable=False)
     seeking_description = db.Column(db.Text, nullable=True)
+    num_upcoming_shows = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
+    num_past_shows = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)
 
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    shows = db.relationship('Show', backref='artist', lazy=True, passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Artist {self.id} {self.name}>'
@@ -88,11 +106,100 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # Range queries on an artist's or a venue's shows, e.g. the calendar feeds.
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False, index=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.now, onupdate=datetime.now, server_default=db.func.now(), nullable=False
+    )
 
     def __repr__(self):
         return f'<Show {self.id} {str(self.start_time)}>'
+
+    @validates('start_time')
+    def validate_start_time(self, key, value):
+        # Form submissions hand over strings; counters need a real datetime.
+        return dateutil.parser.parse(value) if isinstance(value, str) else value
+
+
+def adjust_show_counters(connection, artist_id, venue_id, start_time, delta):
+    """
+    Add `delta` to the upcoming or past show counter of a show's artist and venue.
+
+    :param connection:
+    :param artist_id:
+    :param venue_id:
+    :param start_time:
+    :param delta:
+    """
+    if start_time is None:
+        return
+    counter = 'num_upcoming_shows' if start_time >= datetime.now() else 'num_past_shows'
+    for model, id in ((Artist, artist_id), (Venue, venue_id)):
+        column = getattr(model.__table__.c, counter)
+        connection.execute(
+            model.__table__.update().where(model.__table__.c.id == id).values({counter: column + delta})
+        )
+
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+    adjust_show_counters(connection, show.artist_id, show.venue_id, show.start_time, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+    adjust_show_counters(connection, show.artist_id, show.venue_id, show.start_time, -1)
+
+
+@event.listens_for(Show, 'before_update')
+def count_updated_show(mapper, connection, show):
+    state = inspect(show)
+    added = [state.attrs[attr].history.added for attr in ('artist_id', 'venue_id', 'start_time')]
+    if not any(added):
+        return
+    # Attribute history misses old values of expired attributes; read the row as it is before the UPDATE.
+    table = Show.__table__
+    old_values = connection.execute(
+        db.select(table.c.artist_id, table.c.venue_id, table.c.start_time).where(table.c.id == show.id)
+    ).one()
+    new_values = [values[0] if values else old for values, old in zip(added, old_values)]
+    adjust_show_counters(connection, *old_values, -1)
+    adjust_show_counters(connection, *new_values, 1)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def hide_soft_deleted(execute_state):
+    """
+    Filter soft-deleted venues, artists and shows out of every ORM query.
+
+    Pass `execution_options(include_deleted=True)` to see them.
+    """
+    if not execute_state.is_select or execute_state.is_column_load:
+        return
+    if execute_state.execution_options.get('include_deleted', False):
+        return
+    execute_state.statement = execute_state.statement.options(*[
+        with_loader_criteria(model, model.deleted_at.is_(None), include_aliases=True)
+        for model in (Venue, Artist, Show)
+    ])
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """
+    SQLite leaves foreign keys off by default, so hard deletes would orphan
+    shows instead of cascading to them.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
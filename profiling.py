@@ -0,0 +1,247 @@
+"""On-demand request profiling for `Fyyur` app.
+
+When `PROFILING_ENABLED` is set, a request is profiled if it carries a valid
+signed `X-Fyyur-Profile` header (see `flask profiling token`) or is picked by
+`PROFILING_SAMPLE_RATE`. Captures are written to `PROFILING_DIR`, one file per
+request named after its route:
+
+* `cprofile` mode writes `.prof` files (pstats), readable by snakeviz,
+  flameprof or tuna.
+* `sampling` mode writes `.folded` stacks, readable by flamegraph.pl or
+  speedscope.
+
+`/admin/profiles` lists the captures and lets them be downloaded. It takes
+the same signed token, as the header or a `token` query argument, and
+answers 404 without one.
+"""
+
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import abort, g, render_template, request, send_from_directory
+from itsdangerous import BadSignature, TimestampSigner
+
+PROFILE_HEADER = 'X-Fyyur-Profile'
+PROFILE_SALT = 'fyyur-profile'
+TOKEN_MAX_AGE = 60 * 60
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S%f'
+EXTENSIONS = {'cprofile': 'prof', 'sampling': 'folded'}
+
+
+class CProfileCapture:
+    """Deterministic capture through `cProfile`."""
+
+    extension = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class SamplingCapture:
+    """Statistical capture sampling the request thread's stack."""
+
+    extension = 'folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def dump(self, path):
+        with open(path, 'w') as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write(f'{stack} {count}\n')
+
+
+def get_signer(app):
+    """
+    Signer for profile tokens.
+
+    :param app:
+    """
+    return TimestampSigner(app.config['PROFILING_SECRET'], salt=PROFILE_SALT)
+
+
+def is_valid_token(app, token):
+    """
+    Whether `token` is a current profile token.
+
+    :param app:
+    :param token:
+    """
+    if not token or not app.config.get('PROFILING_SECRET'):
+        return False
+    try:
+        get_signer(app).unsign(token, max_age=TOKEN_MAX_AGE)
+        return True
+    except BadSignature:
+        return False
+
+
+def should_profile(app):
+    """
+    Whether the current request asked for, or was sampled for, a capture.
+
+    :param app:
+    """
+    if is_valid_token(app, request.headers.get(PROFILE_HEADER)):
+        return True
+    return random.random() < app.config.get('PROFILING_SAMPLE_RATE', 0)
+
+
+def admin_token(app):
+    """
+    Profile token of an admin request, aborting with 404 without a valid one.
+
+    :param app:
+    """
+    token = request.headers.get(PROFILE_HEADER) or request.args.get('token')
+    if not app.config['PROFILING_ENABLED'] or not is_valid_token(app, token):
+        abort(404)
+    return token
+
+
+def list_captures(folder, limit):
+    """
+    Most recent captures in `folder`, newest first.
+
+    :param folder:
+    :param limit:
+    """
+    captures = []
+    for filename in os.listdir(folder) if os.path.isdir(folder) else []:
+        stem, _, extension = filename.rpartition('.')
+        if extension not in EXTENSIONS.values():
+            continue
+        timestamp, _, rest = stem.partition('_')
+        endpoint, _, duration = rest.rpartition('_')
+        try:
+            captured_at = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+        captures.append({
+            'filename': filename,
+            'endpoint': endpoint,
+            'duration': duration,
+            'format': extension,
+            'captured_at': captured_at,
+            'size': os.path.getsize(os.path.join(folder, filename)),
+        })
+    captures.sort(key=lambda capture: capture['captured_at'], reverse=True)
+    return captures[:limit]
+
+
+def register_profiling(app):
+    """
+    Wire the profiling hooks, admin views and `profiling` command into the app.
+
+    :param app:
+    """
+    app.config.setdefault('PROFILING_ENABLED', False)
+    app.config.setdefault('PROFILING_SECRET', None)
+    app.config.setdefault('PROFILING_SAMPLE_RATE', 0)
+    app.config.setdefault('PROFILING_MODE', 'cprofile')
+    app.config.setdefault('PROFILING_INTERVAL', 0.005)
+    app.config.setdefault('PROFILING_DIR', os.path.join(app.root_path, 'profiles'))
+    app.config.setdefault('PROFILING_ADMIN_LIMIT', 50)
+
+    @app.before_request
+    def start_profile():
+        if not app.config['PROFILING_ENABLED'] or request.endpoint in ('static', 'dist_asset'):
+            return
+        if not should_profile(app):
+            return
+        if app.config['PROFILING_MODE'] == 'sampling':
+            capture = SamplingCapture(app.config['PROFILING_INTERVAL'])
+        else:
+            capture = CProfileCapture()
+        try:
+            capture.start()
+        except ValueError as ex:
+            # Only one cProfile profiler can be active at a time.
+            app.logger.warning(f'Skipping profile of {request.path}: {ex}')
+            return
+        g.profile = (capture, time.perf_counter())
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        if 'profile' not in g:
+            return
+        capture, started_at = g.pop('profile')
+        capture.stop()
+        duration = (time.perf_counter() - started_at) * 1000
+
+        folder = app.config['PROFILING_DIR']
+        os.makedirs(folder, exist_ok=True)
+        filename = '{}_{}_{:.0f}ms.{}'.format(
+            datetime.now().strftime(TIMESTAMP_FORMAT), request.endpoint or 'unknown',
+            duration, capture.extension
+        )
+        capture.dump(os.path.join(folder, filename))
+        app.logger.info(f'Profiled {request.method} {request.path} into {filename}')
+
+    @app.route('/admin/profiles')
+    def profiles():
+        """
+        Controller to list the most recent profile captures.
+        """
+        token = admin_token(app)
+        captures = list_captures(app.config['PROFILING_DIR'], app.config['PROFILING_ADMIN_LIMIT'])
+        return render_template('pages/profiles.html', captures=captures, token=token)
+
+    @app.route('/admin/profiles/<path:filename>')
+    def download_profile(filename):
+        """
+        Controller to download a profile capture.
+
+        :param filename:
+        """
+        admin_token(app)
+        return send_from_directory(app.config['PROFILING_DIR'], filename, as_attachment=True)
+
+    @app.cli.group()
+    def profiling():
+        """Request profiling commands."""
+
+    @profiling.command('token')
+    def token_command():
+        """Print a signed token for the X-Fyyur-Profile header."""
+        if not app.config['PROFILING_SECRET']:
+            raise click.ClickException('PROFILING_SECRET is not configured.')
+        click.echo(get_signer(app).sign('profile').decode())
@@ -0,0 +1,182 @@
+"""Batch and recurring show scheduling for `Fyyur` app.
+
+Each request names an artist, a venue and a start time, optionally repeated
+weekly or monthly until an end date. All requests are expanded into
+occurrences and validated together, then every valid occurrence is inserted
+with one bulk INSERT in a single transaction.
+"""
+
+from datetime import datetime
+
+import dateutil.parser
+from dateutil.rrule import rrule, WEEKLY, MONTHLY
+
+from config import db
+from counters import recompute_counters
+from models import Venue, Artist, Show
+
+FREQUENCIES = {'weekly': WEEKLY, 'monthly': MONTHLY}
+MAX_OCCURRENCES = 366
+
+
+class SchedulingError(ValueError):
+    """Raised when a scheduling request can't be expanded."""
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return dateutil.parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        raise SchedulingError(f'Invalid date `{value}`.')
+
+
+def parse_id(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise SchedulingError(f'Invalid {name} `{value}`.')
+
+
+def expand_occurrences(start_time, repeat=None, repeat_until=None):
+    """
+    Start times of a show, following an RRULE-style weekly or monthly recurrence.
+
+    A monthly show from the 29th, 30th or 31st falls on the last day of the
+    months that are shorter.
+
+    :param start_time:
+    :param repeat=None:
+    :param repeat_until=None:
+    """
+    start_time = parse_datetime(start_time)
+    if not repeat:
+        return [start_time]
+    if repeat not in FREQUENCIES:
+        raise SchedulingError(f'Unknown recurrence `{repeat}`.')
+    if not repeat_until:
+        raise SchedulingError('A recurring show needs an end date.')
+
+    until = parse_datetime(repeat_until)
+    if until.time() == datetime.min.time():
+        # A bare end date includes shows on that day.
+        until = until.replace(hour=23, minute=59, second=59)
+    if until < start_time:
+        raise SchedulingError('The end date is before the first show.')
+    options = {}
+    if repeat == 'monthly' and start_time.day > 28:
+        # The show's day, or the month's last day if that comes first.
+        options = {'bymonthday': (start_time.day, -1), 'bysetpos': 1}
+    occurrences = list(
+        rrule(FREQUENCIES[repeat], dtstart=start_time, until=until, **options)[:MAX_OCCURRENCES + 1]
+    )
+    if not occurrences:
+        raise SchedulingError('The recurrence has no occurrences.')
+    if len(occurrences) > MAX_OCCURRENCES:
+        raise SchedulingError(f'A recurrence can\'t have more than {MAX_OCCURRENCES} occurrences.')
+    return occurrences
+
+
+def expand_requests(requests):
+    """
+    Expand scheduling requests into occurrences.
+
+    Returns `(occurrences, failures)`; each occurrence is a `Show` row and each
+    failure a dict describing the request and why it was rejected.
+
+    :param requests:
+    """
+    occurrences, failures = [], []
+    for index, show_request in enumerate(requests):
+        try:
+            if not isinstance(show_request, dict):
+                raise SchedulingError('Expected an object with artist_id, venue_id and start_time.')
+            artist_id = parse_id(show_request.get('artist_id'), 'artist_id')
+            venue_id = parse_id(show_request.get('venue_id'), 'venue_id')
+            start_times = expand_occurrences(
+                show_request.get('start_time'), show_request.get('repeat'), show_request.get('repeat_until')
+            )
+        except SchedulingError as ex:
+            failures.append({'index': index, 'start_time': None, 'error': str(ex)})
+            continue
+        occurrences.extend(
+            {'index': index, 'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start_time}
+            for start_time in start_times
+        )
+    return occurrences, failures
+
+
+def validate_occurrences(occurrences):
+    """
+    Split occurrences into valid ones and failures, checking every one of them
+    with a fixed number of queries.
+
+    :param occurrences:
+    """
+    if not occurrences:
+        return [], []
+
+    artist_ids = {occurrence['artist_id'] for occurrence in occurrences}
+    venue_ids = {occurrence['venue_id'] for occurrence in occurrences}
+    start_times = {occurrence['start_time'] for occurrence in occurrences}
+
+    known_artists = set(db.session.scalars(db.select(Artist.id).where(Artist.id.in_(artist_ids))))
+    known_venues = set(db.session.scalars(db.select(Venue.id).where(Venue.id.in_(venue_ids))))
+    booked = db.session.execute(
+        db.select(Show.artist_id, Show.venue_id, Show.start_time).where(
+            Show.start_time.in_(start_times),
+            db.or_(Show.artist_id.in_(artist_ids), Show.venue_id.in_(venue_ids))
+        )
+    ).all()
+    booked_artists = {(artist_id, start_time) for artist_id, _, start_time in booked}
+    booked_venues = {(venue_id, start_time) for _, venue_id, start_time in booked}
+
+    valid, failures = [], []
+    for occurrence in occurrences:
+        artist_slot = (occurrence['artist_id'], occurrence['start_time'])
+        venue_slot = (occurrence['venue_id'], occurrence['start_time'])
+        if occurrence['artist_id'] not in known_artists:
+            error = f'Artist {occurrence["artist_id"]} doesn\'t exist.'
+        elif occurrence['venue_id'] not in known_venues:
+            error = f'Venue {occurrence["venue_id"]} doesn\'t exist.'
+        elif artist_slot in booked_artists:
+            error = 'The artist already has a show at this time.'
+        elif venue_slot in booked_venues:
+            error = 'The venue already has a show at this time.'
+        else:
+            booked_artists.add(artist_slot)
+            booked_venues.add(venue_slot)
+            valid.append(occurrence)
+            continue
+        failures.append({
+            'index': occurrence['index'],
+            'start_time': occurrence['start_time'].isoformat(),
+            'error': error,
+        })
+    return valid, failures
+
+
+def schedule_shows(requests):
+    """
+    Expand, validate and insert shows in one transaction.
+
+    Returns `(created, failures)`; the caller commits.
+
+    :param requests:
+    """
+    occurrences, failures = expand_requests(requests)
+    valid, invalid = validate_occurrences(occurrences)
+    failures.extend(invalid)
+
+    if valid:
+        db.session.execute(db.insert(Show), [
+            {key: occurrence[key] for key in ('artist_id', 'venue_id', 'start_time')}
+            for occurrence in valid
+        ])
+        # The bulk INSERT bypasses the `Show` mapper events.
+        recompute_counters(Artist, Show.artist_id, {occurrence['artist_id'] for occurrence in valid})
+        recompute_counters(Venue, Show.venue_id, {occurrence['venue_id'] for occurrence in valid})
+
+    failures.sort(key=lambda failure: failure['index'])
+    return len(valid), failures
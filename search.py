@@ -0,0 +1,199 @@
+"""Unified search for `Fyyur` app.
+
+`/search?q=` looks up venues, artists and upcoming shows concurrently on a
+thread pool, one app context and session per lookup, and merges the results
+into one list ranked by how well the name matches the term:
+
+* exact match, then prefix, then word prefix, then anywhere in the name;
+* venues and artists with more upcoming shows first, then shows by date.
+
+Every lookup has to finish within `SEARCH_DEADLINE` seconds. Lookups that
+don't are left out of the page and reported as timed out, apart from those that
+raised, which are reported as failed. Late lookups that haven't started are
+cancelled; on PostgreSQL the query of a running one is cancelled by a
+`statement_timeout`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from flask import current_app
+
+from config import db
+from models import Venue, Artist, Show
+from search_cache import normalize_term
+from serializers.utils import select_shows, serialize_show_row
+
+# Relevance of each match kind, best first.
+MATCH_SCORES = (1.0, 0.75, 0.6, 0.4)
+TYPES = ('venue', 'artist', 'show')
+
+
+def match_rank(column, term):
+    """
+    SQL expression ranking how `column` matches `term`, an index into `MATCH_SCORES`.
+
+    :param column:
+    :param term:
+    """
+    name = db.func.lower(column)
+    return db.case(
+        (name == term, 0),
+        (name.startswith(term, autoescape=True), 1),
+        (name.contains(f' {term}', autoescape=True), 2),
+        else_=3
+    )
+
+
+def set_statement_timeout(deadline):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.text(f"SET LOCAL statement_timeout = {int(deadline * 1000)}"))
+
+
+def entity_search_statement(model, term, limit):
+    """
+    Best `limit` venues or artists matching `term`, with the total number of matches.
+
+    :param model:
+    :param term:
+    :param limit:
+    """
+    rank = match_rank(model.name, term)
+    return db.select(
+        model.id, model.name, model.num_upcoming_shows, rank.label('rank'), db.func.count().over().label('total')
+    ).where(model.name.icontains(term, autoescape=True)) \
+        .order_by(rank, model.num_upcoming_shows.desc(), model.name, model.id) \
+        .limit(limit)
+
+
+def show_search_statement(term, limit, dialect_name):
+    """
+    Soonest `limit` upcoming shows whose artist or venue matches `term`, with
+    the total number of matches.
+
+    :param term:
+    :param limit:
+    :param dialect_name:
+    """
+    # SQLite spells `least` as a multi-argument `min`.
+    least = db.func.min if dialect_name == 'sqlite' else db.func.least
+    rank = least(match_rank(Artist.name, term), match_rank(Venue.name, term))
+    return select_shows(rank.label('rank'), db.func.count().over().label('total')) \
+        .where(
+            Show.start_time >= datetime.now(),
+            db.or_(Artist.name.icontains(term, autoescape=True), Venue.name.icontains(term, autoescape=True))
+        ) \
+        .order_by(rank, Show.start_time, Show.id) \
+        .limit(limit)
+
+
+def search_statement(entity, term, limit, dialect_name):
+    if entity == 'show':
+        return show_search_statement(term, limit, dialect_name)
+    return entity_search_statement(Venue if entity == 'venue' else Artist, term, limit)
+
+
+def search_results(entity, rows):
+    """
+    Scored results of a lookup and its total number of matches.
+
+    :param entity:
+    :param rows:
+    """
+    results = []
+    for row in rows:
+        if entity == 'show':
+            result = serialize_show_row(row)
+            del result['rank'], result['total']
+            # Below a venue or artist with an equally good match.
+            result.update(
+                type='show', name=f'{row.artist_name} at {row.venue_name}', score=MATCH_SCORES[row.rank] - 0.05
+            )
+        else:
+            result = {
+                'type': entity,
+                'id': row.id,
+                'name': row.name,
+                'num_upcoming_shows': row.num_upcoming_shows,
+                'score': MATCH_SCORES[row.rank] + min(row.num_upcoming_shows, 10) / 100,
+            }
+        results.append(result)
+    return results, rows[0].total if rows else 0
+
+
+def run_lookup(app, entity, term, limit, deadline):
+    with app.app_context():
+        set_statement_timeout(deadline)
+        dialect_name = db.session.get_bind().dialect.name
+        return search_results(entity, db.session.execute(search_statement(entity, term, limit, dialect_name)).all())
+
+
+def empty_search():
+    return {'results': [], 'counts': dict.fromkeys(TYPES, 0), 'timed_out': [], 'failed': []}
+
+
+def merge_results(term, lookups):
+    """
+    Merge finished lookups into one ranked list.
+
+    `lookups` maps each type to a future or task; those not done yet are
+    reported as timed out.
+
+    :param term:
+    :param lookups:
+    """
+    results, counts = [], dict.fromkeys(TYPES)
+    timed_out, failed = [], []
+    for entity, lookup in lookups.items():
+        if not lookup.done():
+            timed_out.append(entity)
+            continue
+        try:
+            entity_results, counts[entity] = lookup.result()
+        except Exception as ex:
+            current_app.logger.error(f'Search for `{term}` in {entity} failed: {ex}')
+            failed.append(entity)
+            continue
+        results.extend(entity_results)
+
+    results.sort(key=lambda result: -result['score'])
+    return {'results': results, 'counts': counts, 'timed_out': timed_out, 'failed': failed}
+
+
+def search(term, limit=None, deadline=None):
+    """
+    Search venues, artists and upcoming shows concurrently.
+
+    Returns a dict with the merged, ranked `results`, the per-type match
+    `counts`, and the types that `timed_out` or `failed`, whose count is None.
+
+    :param term:
+    :param limit=None: results per type, `SEARCH_LIMIT` by default
+    :param deadline=None: seconds, `SEARCH_DEADLINE` by default
+    """
+    term = normalize_term(term)
+    if not term:
+        return empty_search()
+
+    app = current_app._get_current_object()
+    limit = limit or app.config['SEARCH_LIMIT']
+    deadline = deadline or app.config['SEARCH_DEADLINE']
+    executor = app.extensions['search_executor']
+    futures = {entity: executor.submit(run_lookup, app, entity, term, limit, deadline) for entity in TYPES}
+    wait(futures.values(), timeout=deadline)
+    results = merge_results(term, futures)
+    # Lookups still queued behind busy workers won't run; running ones finish in the background.
+    for future in futures.values():
+        future.cancel()
+    return results
+
+
+def register_search(app):
+    """
+    Create the thread pool that runs the app's search lookups.
+
+    :param app:
+    """
+    app.extensions['search_executor'] = ThreadPoolExecutor(
+        max_workers=app.config.get('SEARCH_WORKERS', 8), thread_name_prefix='search'
+    )
@@ -0,0 +1,179 @@
+"""Search result cache for `Fyyur` app.
+
+Results of `/venues/search` and `/artists/search` are cached per worker in an
+LRU keyed on the entity type and the normalized search term, with a TTL.
+Concurrent misses for the same key are coalesced: the first request runs the
+query while the others wait for its result.
+
+Entries are dropped once a transaction that creates, renames or deletes a
+matching venue or artist commits. Statistics are served at
+`/admin/search-cache`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from flask import jsonify
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Venue, Artist
+
+ENTITIES = {Venue: 'venue', Artist: 'artist'}
+PENDING_KEY = 'search_cache_invalidations'
+
+
+def normalize_term(term):
+    """
+    Collapse whitespace and case so equivalent searches share an entry.
+
+    :param term:
+    """
+    return ' '.join((term or '').split()).casefold()
+
+
+class SearchCache:
+    """Thread-safe LRU cache with TTL and request coalescing."""
+
+    def __init__(self, maxsize=1024, ttl=60, wait_timeout=10):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_or_compute(self, entity, term, compute):
+        """
+        Cached results for `term`, calling `compute(term)` on a miss.
+
+        :param entity:
+        :param term:
+        :param compute:
+        """
+        key = (entity, normalize_term(term))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return entry[1]
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                self.counts['misses'] += 1
+            else:
+                self.counts['coalesced'] += 1
+
+        if not leader:
+            return future.result(timeout=self.wait_timeout)
+
+        try:
+            value = compute(key[1])
+        except BaseException as ex:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(ex)
+            raise
+
+        with self.lock:
+            # An invalidation while computing drops the in-flight marker,
+            # in which case the result may be stale and isn't stored.
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.counts['evictions'] += 1
+        future.set_result(value)
+        return value
+
+    def invalidate(self, entity, name=None):
+        """
+        Drop entries whose term matches `name`, or every entry of `entity`.
+
+        :param entity:
+        :param name=None:
+        """
+        name = normalize_term(name) if name is not None else None
+        with self.lock:
+            for store in (self.entries, self.in_flight):
+                for key in [key for key in store if key[0] == entity and (name is None or key[1] in name)]:
+                    del store[key]
+                    if store is self.entries:
+                        self.counts['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.in_flight.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses'] + self.counts['coalesced']
+            return {
+                **self.counts,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hit_rate': (self.counts['hits'] + self.counts['coalesced']) / lookups if lookups else 0.0,
+            }
+
+
+def queue_invalidation(session, entity, name=None):
+    """
+    Invalidate matching entries once `session` commits.
+
+    :param session:
+    :param entity:
+    :param name=None:
+    """
+    session.info.setdefault(PENDING_KEY, set()).add((entity, name))
+
+
+def register_search_cache(app):
+    """
+    Create the app's search cache and wire its invalidation and stats view.
+
+    :param app:
+    """
+    cache = SearchCache(
+        maxsize=app.config.get('SEARCH_CACHE_SIZE', 1024),
+        ttl=app.config.get('SEARCH_CACHE_TTL', 60),
+    )
+    app.extensions['search_cache'] = cache
+
+    def queue_names(mapper, connection, target):
+        session = object_session(target)
+        if session is None:
+            return
+        history = inspect(target).attrs.name.history
+        for name in (history.added or []) + (history.deleted or []) + (history.unchanged or []):
+            queue_invalidation(session, ENTITIES[mapper.class_], name)
+
+    for model in ENTITIES:
+        for identifier in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, identifier, queue_names)
+
+    @event.listens_for(Session, 'after_commit')
+    def apply_invalidations(session):
+        for entity, name in session.info.pop(PENDING_KEY, ()):
+            cache.invalidate(entity, name)
+
+    @event.listens_for(Session, 'after_rollback')
+    def discard_invalidations(session):
+        session.info.pop(PENDING_KEY, None)
+
+    @app.route('/admin/search-cache')
+    def search_cache_stats():
+        """
+        Controller to report search cache statistics.
+        """
+        return jsonify(cache.stats())
+
+    return cache
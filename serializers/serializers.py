@@ -1,42 +1,70 @@
-"""Module for serializing querysets."""
+"""Module for serializing querysets.
+
+When `many=True` is given a query rather than a list of instances, the
+summarized and show serializers only load the columns they declare in
+`utils` and serialize the resulting lightweight rows. With `stream=True`
+they return a generator fetching `YIELD_PER` rows at a time instead of a list.
+"""
+
+from sqlalchemy.orm import Query
 
 from .utils import (
     serialize_detailed_artist_instance, serialize_detailed_venue_instance,
     serialize_summarized_artist_instance, serialize_summarized_venue_instance,
-    serialize_show_instance
+    serialize_show_instance, serialize_show_row, serialize_summarized_row,
+    project_shows, project_summarized_artists, project_summarized_venues
 )
 
+YIELD_PER = 1000
+
+
+def serialize_rows(serializer_func, query, stream):
+    if stream:
+        return ( serializer_func(row) for row in query.yield_per(YIELD_PER) )
+    return [ serializer_func(row) for row in query ]
+
 
-def serialize_show(shows, many=False):
+def serialize_show(shows, many=False, stream=False):
     """
     Serializer for show.
 
     :param artists:
     :param many=False:
     :param summarized=True:
+    :param stream=False:
     """
+    if many and isinstance(shows, Query):
+        return serialize_rows(serialize_show_row, project_shows(shows), stream)
     return [ serialize_show_instance(show) for show in shows ] if many else serialize_show_instance(shows)
 
 
-def serialize_artist(artists, many=False, summarized=True):
+def serialize_artist(artists, many=False, summarized=True, stream=False, **shows):
     """
     Serializer for artist.
 
     :param artists:
     :param many=False:
     :param summarized=True:
+    :param stream=False:
+    :param shows: preloaded `past_shows` and `upcoming_shows` of a detailed artist
     """
+    if many and summarized and isinstance(artists, Query):
+        return serialize_rows(serialize_summarized_row, project_summarized_artists(artists), stream)
     serializer_func = serialize_summarized_artist_instance if summarized else serialize_detailed_artist_instance
-    return [ serializer_func(artist) for artist in artists ] if many else serializer_func(artists)
+    return [ serializer_func(artist) for artist in artists ] if many else serializer_func(artists, **shows)
 
 
-def serialize_venue(venues, many=False, summarized=True):
+def serialize_venue(venues, many=False, summarized=True, stream=False, **shows):
     """
     Serializer for venue.
 
     :param artists:
     :param many=False:
     :param summarized=True:
+    :param stream=False:
+    :param shows: preloaded `past_shows` and `upcoming_shows` of a detailed venue
     """
+    if many and summarized and isinstance(venues, Query):
+        return serialize_rows(serialize_summarized_row, project_summarized_venues(venues), stream)
     serializer_func = serialize_summarized_venue_instance if summarized else serialize_detailed_venue_instance
-    return [ serializer_func(venue) for venue in venues ] if many else serializer_func(venues)
+    return [ serializer_func(venue) for venue in venues ] if many else serializer_func(venues, **shows)
@@ -1,8 +1,77 @@
 from datetime import datetime
 
+from sqlalchemy import select
+
+from models import Venue, Artist, Show
+
 DATETIME_FORMAT = '%b %d %Y %H:%M:%S'
 
 
+# Columns loaded by the list views, in place of full ORM instances.
+SHOW_COLUMNS = (
+    Show.id, Show.start_time, Show.venue_id, Show.artist_id,
+    Venue.name.label('venue_name'), Artist.name.label('artist_name'),
+    Artist.image_link.label('artist_image_link')
+)
+SUMMARIZED_ARTIST_COLUMNS = (Artist.id, Artist.name, Artist.num_upcoming_shows)
+SUMMARIZED_VENUE_COLUMNS = (Venue.id, Venue.name, Venue.city, Venue.state, Venue.num_upcoming_shows)
+# Columns of the show lists on the venue and artist pages.
+VENUE_PAGE_SHOW_COLUMNS = (
+    Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'), Show.start_time
+)
+ARTIST_PAGE_SHOW_COLUMNS = (
+    Show.venue_id, Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'), Show.start_time
+)
+
+
+def project_shows(query):
+    return query.with_entities(*SHOW_COLUMNS) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .join(Artist, Show.artist_id == Artist.id)
+
+
+def select_shows(*columns):
+    return select(*SHOW_COLUMNS, *columns) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .join(Artist, Show.artist_id == Artist.id)
+
+
+def select_page_shows(model, id, upcoming):
+    """
+    Statement for the upcoming or past shows listed on a venue or artist page.
+
+    :param model:
+    :param id:
+    :param upcoming:
+    """
+    now = datetime.now()
+    if model is Venue:
+        statement = select(*VENUE_PAGE_SHOW_COLUMNS).join(Artist, Show.artist_id == Artist.id) \
+            .where(Show.venue_id == id)
+    else:
+        statement = select(*ARTIST_PAGE_SHOW_COLUMNS).join(Venue, Show.venue_id == Venue.id) \
+            .where(Show.artist_id == id)
+    return statement.where(Show.start_time >= now if upcoming else Show.start_time < now)
+
+
+def project_summarized_artists(query):
+    return query.with_entities(*SUMMARIZED_ARTIST_COLUMNS)
+
+
+def project_summarized_venues(query):
+    return query.with_entities(*SUMMARIZED_VENUE_COLUMNS)
+
+
+def serialize_show_row(row):
+    serialized_data = row._asdict()
+    serialized_data['start_time'] = row.start_time.strftime(DATETIME_FORMAT)
+    return serialized_data
+
+
+def serialize_summarized_row(row):
+    return row._asdict()
+
+
 def serialize_show_instance(show):
     return {
         'id': show.id,
@@ -15,13 +84,16 @@ def serialize_show_instance(show):
     }
 
 
-def serialize_detailed_artist_instance(artist):
+def serialize_detailed_artist_instance(artist, past_shows=None, upcoming_shows=None):
     serialized_data = {
         attr: getattr(artist, attr) for attr in [
             "id", "name", "city", "state", "phone", "website", "facebook_link",
-            "seeking_venue", "seeking_description", "image_link", 'past_shows', 'upcoming_shows'
+            "seeking_venue", "seeking_description", "image_link"
         ]
     }
+    # Shows loaded up front are used as they are, the others are queried here.
+    serialized_data['past_shows'] = artist.past_shows if past_shows is None else past_shows
+    serialized_data['upcoming_shows'] = artist.upcoming_shows if upcoming_shows is None else upcoming_shows
 
     serialized_data['genres'] = artist.genres.split(',') if artist.genres else []
     serialized_data['past_shows_count'] = len(serialized_data['past_shows'])
@@ -32,17 +104,20 @@ def serialize_detailed_artist_instance(artist):
 
 def serialize_summarized_artist_instance(artist):
     return {
-        'id': artist.id, 'name': artist.name, 'num_upcoming_shows': len(artist.upcoming_shows)
+        'id': artist.id, 'name': artist.name, 'num_upcoming_shows': artist.num_upcoming_shows
     }
 
 
-def serialize_detailed_venue_instance(venue):
+def serialize_detailed_venue_instance(venue, past_shows=None, upcoming_shows=None):
     serialized_data = {
         attr: getattr(venue, attr) for attr in [
             "id", "name", "city", "state", "phone", "website", "facebook_link",
-            "seeking_talent", "seeking_description", "image_link", 'past_shows', 'upcoming_shows'
+            "seeking_talent", "seeking_description", "image_link"
         ]
     }
+    # Shows loaded up front are used as they are, the others are queried here.
+    serialized_data['past_shows'] = venue.past_shows if past_shows is None else past_shows
+    serialized_data['upcoming_shows'] = venue.upcoming_shows if upcoming_shows is None else upcoming_shows
 
     serialized_data['genres'] = venue.genres.split(',') if venue.genres else []
     serialized_data['past_shows_count'] = len(serialized_data['past_shows'])
@@ -53,5 +128,5 @@ def serialize_detailed_venue_instance(venue):
 
 def serialize_summarized_venue_instance(venue):
     return {
-        'id': venue.id, 'name': venue.name, 'num_upcoming_shows': len(venue.upcoming_shows)
+        'id': venue.id, 'name': venue.name, 'num_upcoming_shows': venue.num_upcoming_shows
     }
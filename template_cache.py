@@ -0,0 +1,78 @@
+"""Jinja bytecode cache for `Fyyur` app.
+
+Compiled templates are stored in `TEMPLATE_CACHE_DIR`, shared by every
+worker on the host, so a template is compiled once per deploy instead of
+once per worker process. Entries are keyed on the template name and checked
+against the source checksum and Python version, so edited templates are
+recompiled rather than served stale.
+
+`flask templates compile` fills the cache at build time, before the first
+worker starts; `flask templates clear` empties it.
+"""
+
+import os
+import time
+
+import click
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+
+def compile_templates(env):
+    """
+    Compile every template `env` can load, storing the bytecode in its cache.
+
+    Returns `(compiled, errors)`, where `errors` maps template names to
+    syntax errors.
+
+    :param env:
+    """
+    compiled, errors = [], {}
+    for name in env.list_templates(extensions=['html']):
+        try:
+            # `get_template` stores the bytecode on a cache miss.
+            env.get_template(name)
+        except TemplateSyntaxError as ex:
+            errors[name] = ex
+        else:
+            compiled.append(name)
+    return compiled, errors
+
+
+def register_template_cache(app):
+    """
+    Attach the shared bytecode cache to the app's Jinja environment and wire
+    the `templates` command.
+
+    :param app:
+    """
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    @app.cli.group()
+    def templates():
+        """Template bytecode cache commands."""
+
+    @templates.command('compile')
+    def compile_command():
+        """Precompile every template into the bytecode cache."""
+        if app.jinja_env.bytecode_cache is None:
+            raise click.ClickException('TEMPLATE_CACHE_DIR is not set.')
+        started_at = time.perf_counter()
+        compiled, errors = compile_templates(app.jinja_env)
+        for name, error in errors.items():
+            click.echo(f'{name}: {error}', err=True)
+        click.echo(
+            f'Compiled {len(compiled)} templates into {directory} '
+            f'in {(time.perf_counter() - started_at) * 1000:.0f} ms'
+        )
+        if errors:
+            raise click.ClickException(f'{len(errors)} templates failed to compile.')
+
+    @templates.command('clear')
+    def clear_command():
+        """Remove every compiled template from the bytecode cache."""
+        if app.jinja_env.bytecode_cache is not None:
+            app.jinja_env.bytecode_cache.clear()
+            click.echo(f'Cleared {directory}')
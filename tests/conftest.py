@@ -0,0 +1,8 @@
+import os
+import sys
+
+# make the app's top-level modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# `config` reads the database URL on import; tests point the app at their own databases.
+os.environ.setdefault('FYYUR_DATABASE_URL', 'sqlite://')
@@ -0,0 +1,121 @@
+"""Migrations run against a seeded database while a writer measures how long they lock it.
+
+Runs on a temporary SQLite database; set `FYYUR_TEST_DATABASE_URL` to an
+empty PostgreSQL database to measure the locks there. Its tables are dropped
+afterwards.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+from flask_migrate import upgrade
+
+from app import app
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+# Last revision before the migrations that add NOT NULL columns to populated tables.
+SEEDED_REVISION = '8b2e4d6f1a90'
+NUM_ENTITIES = 200
+NUM_SHOWS = 20000
+# Longest a write may wait for the migrations, in seconds.
+MAX_LOCK_WAIT = float(os.environ.get('FYYUR_TEST_MAX_LOCK_WAIT', 1))
+
+venue = sa.table('Venue', sa.column('id'), sa.column('name'), sa.column('seeking_talent'))
+artist = sa.table('Artist', sa.column('id'), sa.column('name'), sa.column('seeking_venue'))
+show = sa.table('Show', sa.column('id'), sa.column('start_time'), sa.column('artist_id'), sa.column('venue_id'))
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    url = os.environ.get('FYYUR_TEST_DATABASE_URL', f'sqlite:///{tmp_path / "fyyur.db"}')
+    yield url
+    engine = sa.create_engine(url)
+    metadata = sa.MetaData()
+    metadata.reflect(engine)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+def migrate(database_url, revision='head'):
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR, revision=revision)
+
+
+def seed(engine):
+    with engine.begin() as connection:
+        connection.execute(venue.insert(), [
+            {'id': id, 'name': f'Venue {id}', 'seeking_talent': False} for id in range(1, NUM_ENTITIES + 1)
+        ])
+        connection.execute(artist.insert(), [
+            {'id': id, 'name': f'Artist {id}', 'seeking_venue': False} for id in range(1, NUM_ENTITIES + 1)
+        ])
+        connection.execute(show.insert(), [
+            {
+                'id': id, 'start_time': datetime(2030, 1, 1, id % 24),
+                'artist_id': id % NUM_ENTITIES + 1, 'venue_id': id * 7 % NUM_ENTITIES + 1,
+            }
+            for id in range(1, NUM_SHOWS + 1)
+        ])
+
+
+class LockProbe(threading.Thread):
+    """Writes a row of each migrated table in turn, recording how long each write takes."""
+
+    def __init__(self, engine):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.waits = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        writes = [
+            sa.text(f'UPDATE "{table_name}" SET {column} = {column} WHERE id = 1')
+            for table_name, column in (('Venue', 'name'), ('Artist', 'name'), ('Show', 'start_time'))
+        ]
+        while not self.stopped.is_set():
+            for write in writes:
+                started_at = time.perf_counter()
+                with self.engine.begin() as connection:
+                    connection.execute(write)
+                self.waits.append(time.perf_counter() - started_at)
+            time.sleep(0.001)
+
+
+def test_migrations_keep_locks_short(database_url):
+    migrate(database_url, SEEDED_REVISION)
+    engine = sa.create_engine(database_url, connect_args={'timeout': 60} if database_url.startswith('sqlite') else {})
+    seed(engine)
+
+    probe = LockProbe(engine)
+    probe.start()
+    time.sleep(0.05)
+    writes_before = len(probe.waits)
+    started_at = time.perf_counter()
+    migrate(database_url)
+    elapsed = time.perf_counter() - started_at
+    writes_during = len(probe.waits) - writes_before
+    probe.stopped.set()
+    probe.join()
+
+    longest_wait = max(probe.waits)
+    print(
+        f'migrations took {elapsed * 1000:.0f} ms; {writes_during} concurrent writes, '
+        f'longest wait {longest_wait * 1000:.0f} ms'
+    )
+    # Writes go on between backfill batches and revisions instead of queueing behind the whole upgrade.
+    assert writes_during > 3
+    assert longest_wait < MAX_LOCK_WAIT
+
+    with engine.connect() as connection:
+        assert connection.execute(sa.text('SELECT count(*) FROM "Show" WHERE updated_at IS NULL')).scalar() == 0
+        assert connection.execute(sa.text('SELECT count(*) FROM "Show"')).scalar() == NUM_SHOWS
+        for table_name in ('Venue', 'Artist'):
+            assert connection.execute(
+                sa.text(f'SELECT count(*), min(version), max(version) FROM "{table_name}"')
+            ).one() == (NUM_ENTITIES, 1, 1)
+    engine.dispose()
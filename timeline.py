@@ -0,0 +1,368 @@
+"""In-memory show timeline for `Fyyur` app.
+
+With `SHOW_TIMELINE` on, every worker keeps a snapshot of all shows in
+columnar arrays and answers `/shows` and the past/upcoming split of the venue
+and artist pages from it instead of the database:
+
+* a row store sorted by show id: ids, artist and venue ids as int32 and start
+  times as int64 microseconds, plus a liveness flag;
+* row slots ordered by start time, globally and per venue and artist, searched
+  with `bisect`;
+* artist and venue names and image links, stored once per artist and venue
+  rather than once per show.
+
+The snapshot is refreshed at most every `SHOW_TIMELINE_REFRESH` seconds from a
+change counter, the number of shows and their newest `updated_at`. When it
+moved, only shows updated since the last refresh are reloaded; a count that
+still doesn't match, e.g. after a hard delete, triggers a full rebuild, as
+does a snapshot older than `SHOW_TIMELINE_REBUILD` seconds. Artist and venue
+renames show up after the next full rebuild. Readers hold the snapshot's lock
+from looking up slots until the shows are serialized, so a refresh can't
+swap or shift the arrays under them.
+"""
+
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+import click
+from flask import jsonify
+
+from config import db
+from models import Venue, Artist, Show
+from serializers.utils import DATETIME_FORMAT
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Transactions committing out of `updated_at` order are caught up within this window.
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def to_micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + value * MICROSECOND
+
+
+def deep_sizeof(mapping):
+    return sys.getsizeof(mapping) + sum(
+        sys.getsizeof(key) + (sum(map(sys.getsizeof, value)) if isinstance(value, tuple) else sys.getsizeof(value))
+        for key, value in mapping.items()
+    )
+
+
+class ShowTimeline:
+    """Columnar snapshot of the `Show` table with time-ordered indexes."""
+
+    def __init__(self, refresh_interval=5, rebuild_interval=600):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self.reset()
+        self.built_at = self.checked_at = None
+        self.version = None
+        self.refreshes = {'full': 0, 'incremental': 0}
+
+    def reset(self):
+        self.ids = array('i')
+        self.starts = array('q')
+        self.artist_ids = array('i')
+        self.venue_ids = array('i')
+        self.alive = bytearray()
+        self.order = array('i')
+        self.by_artist = {}
+        self.by_venue = {}
+        # id -> (name, image_link)
+        self.artists = {}
+        self.venues = {}
+        self.live_count = 0
+
+    def sort_key(self, slot):
+        return self.starts[slot], self.ids[slot]
+
+    def change_counter(self):
+        return db.session.execute(
+            db.select(
+                db.func.count(Show.id).filter(Show.deleted_at.is_(None), Show.start_time.is_not(None)),
+                db.func.max(Show.updated_at)
+            ).execution_options(include_deleted=True)
+        ).one()
+
+    def rebuild(self):
+        """
+        Reload every show, artist and venue.
+        """
+        version = self.change_counter()
+        rows = db.session.execute(
+            db.select(Show.id, Show.start_time, Show.artist_id, Show.venue_id)
+            .where(Show.start_time.is_not(None)).order_by(Show.id)
+        )
+        ids, starts, artist_ids, venue_ids = array('i'), array('q'), array('i'), array('i')
+        for id, start_time, artist_id, venue_id in rows:
+            ids.append(id)
+            starts.append(to_micros(start_time))
+            artist_ids.append(artist_id)
+            venue_ids.append(venue_id)
+
+        order = array('i', sorted(range(len(ids)), key=lambda slot: (starts[slot], ids[slot])))
+        by_artist, by_venue = {}, {}
+        for slot in order:
+            by_artist.setdefault(artist_ids[slot], array('i')).append(slot)
+            by_venue.setdefault(venue_ids[slot], array('i')).append(slot)
+
+        artists = {id: (name, image_link) for id, name, image_link in db.session.execute(
+            db.select(Artist.id, Artist.name, Artist.image_link)
+        )}
+        venues = {id: (name, image_link) for id, name, image_link in db.session.execute(
+            db.select(Venue.id, Venue.name, Venue.image_link)
+        )}
+
+        with self.lock:
+            self.ids, self.starts, self.artist_ids, self.venue_ids = ids, starts, artist_ids, venue_ids
+            self.alive = bytearray(b'\x01') * len(ids)
+            self.order, self.by_artist, self.by_venue = order, by_artist, by_venue
+            self.artists, self.venues = artists, venues
+            self.live_count = len(ids)
+            self.version = version
+            self.built_at = self.checked_at = time.monotonic()
+            self.refreshes['full'] += 1
+
+    def unlink(self, slot):
+        for slots in (self.order, self.by_artist[self.artist_ids[slot]], self.by_venue[self.venue_ids[slot]]):
+            del slots[bisect_left(slots, self.sort_key(slot), key=self.sort_key)]
+        self.alive[slot] = 0
+        self.live_count -= 1
+
+    def link(self, slot):
+        self.alive[slot] = 1
+        self.live_count += 1
+        for slots in (
+            self.order,
+            self.by_artist.setdefault(self.artist_ids[slot], array('i')),
+            self.by_venue.setdefault(self.venue_ids[slot], array('i')),
+        ):
+            insort(slots, slot, key=self.sort_key)
+
+    def apply(self, id, start_time, artist_id, venue_id, deleted):
+        """
+        Upsert or remove one show; False when it can't be applied in place.
+        """
+        slot = bisect_left(self.ids, id)
+        if slot < len(self.ids) and self.ids[slot] == id:
+            if self.alive[slot]:
+                self.unlink(slot)
+        elif slot == len(self.ids):
+            if deleted or start_time is None:
+                return True
+            self.ids.append(id)
+            self.starts.append(0)
+            self.artist_ids.append(0)
+            self.venue_ids.append(0)
+            self.alive.append(0)
+        else:
+            # Not a new highest id: the row store would have to be shifted.
+            return False
+
+        if not deleted and start_time is not None:
+            self.starts[slot] = to_micros(start_time)
+            self.artist_ids[slot] = artist_id
+            self.venue_ids[slot] = venue_id
+            self.link(slot)
+        return True
+
+    def refresh(self):
+        """
+        Bring the snapshot up to date if the change counter moved.
+        """
+        now = time.monotonic()
+        if self.built_at is None or now - self.built_at > self.rebuild_interval:
+            return self.rebuild()
+        version = self.change_counter()
+        self.checked_at = now
+        if version == self.version:
+            return
+        since = (self.version[1] or EPOCH) - REFRESH_OVERLAP
+        rows = db.session.execute(
+            db.select(
+                Show.id, Show.start_time, Show.artist_id, Show.venue_id, Show.deleted_at.is_not(None),
+                Artist.name, Artist.image_link, Venue.name, Venue.image_link
+            )
+            .join(Artist, Show.artist_id == Artist.id)
+            .join(Venue, Show.venue_id == Venue.id)
+            .where(Show.updated_at > since)
+            .order_by(Show.id)
+            .execution_options(include_deleted=True)
+        ).all()
+        with self.lock:
+            for id, start_time, artist_id, venue_id, deleted, *names in rows:
+                self.artists.setdefault(artist_id, tuple(names[:2]))
+                self.venues.setdefault(venue_id, tuple(names[2:]))
+                if not self.apply(id, start_time, artist_id, venue_id, deleted):
+                    break
+            else:
+                if self.live_count == version[0]:
+                    self.version = version
+                    self.refreshes['incremental'] += 1
+                    return
+        self.rebuild()
+
+    def ensure_fresh(self):
+        if self.checked_at is not None and time.monotonic() - self.checked_at <= self.refresh_interval:
+            return
+        # One thread refreshes while the others keep reading the current snapshot.
+        if not self.refresh_lock.acquire(blocking=self.checked_at is None):
+            return
+        try:
+            self.refresh()
+        finally:
+            self.refresh_lock.release()
+
+    def serialize(self, slot):
+        artist_name, artist_image_link = self.artists.get(self.artist_ids[slot], (None, None))
+        venue_name, venue_image_link = self.venues.get(self.venue_ids[slot], (None, None))
+        return {
+            'id': self.ids[slot],
+            'start_time': from_micros(self.starts[slot]).strftime(DATETIME_FORMAT),
+            'venue_id': self.venue_ids[slot],
+            'artist_id': self.artist_ids[slot],
+            'venue_name': venue_name,
+            'artist_name': artist_name,
+            'artist_image_link': artist_image_link,
+            'venue_image_link': venue_image_link,
+        }
+
+    def slice(self, slots, start=None, end=None, limit=None):
+        """
+        Slots in `slots` starting in `[start, end)`, at most `limit` of them.
+        Call with `self.lock` held, until the slots are serialized.
+        """
+        low = 0 if start is None else bisect_left(slots, to_micros(start), key=lambda slot: self.starts[slot])
+        high = len(slots) if end is None else bisect_left(slots, to_micros(end), key=lambda slot: self.starts[slot])
+        if limit is not None:
+            high = min(high, low + limit)
+        return slots[low:high]
+
+    def shows(self, start=None, end=None, limit=None):
+        """
+        Shows starting in `[start, end)`, in start time order.
+
+        :param start=None:
+        :param end=None:
+        :param limit=None:
+        """
+        self.ensure_fresh()
+        with self.lock:
+            return [self.serialize(slot) for slot in self.slice(self.order, start, end, limit)]
+
+    def next_shows(self, n, now=None):
+        """
+        The next `n` shows across all venues.
+
+        :param n:
+        :param now=None:
+        """
+        return self.shows(start=now or datetime.now(), limit=n)
+
+    def entity_shows(self, model, id, upcoming=True, now=None):
+        """
+        Upcoming or past shows of a venue or an artist, in start time order.
+
+        :param model:
+        :param id:
+        :param upcoming=True:
+        :param now=None:
+        """
+        self.ensure_fresh()
+        with self.lock:
+            return self.select_entity_shows(model, id, upcoming, now or datetime.now())
+
+    def select_entity_shows(self, model, id, upcoming, now):
+        # Call with `self.lock` held.
+        slots = (self.by_venue if model is Venue else self.by_artist).get(id, array('i'))
+        selected = self.slice(slots, start=now) if upcoming else self.slice(slots, end=now)
+        return [self.serialize(slot) for slot in selected]
+
+    def page_shows(self, model, id):
+        self.ensure_fresh()
+        now = datetime.now()
+        # One lock hold, so both lists come from the same snapshot.
+        with self.lock:
+            return {
+                'past_shows': self.select_entity_shows(model, id, False, now),
+                'upcoming_shows': self.select_entity_shows(model, id, True, now),
+            }
+
+    def memory(self):
+        """
+        Bytes held by the snapshot, by part.
+        """
+        with self.lock:
+            columns = sum(map(sys.getsizeof, (self.ids, self.starts, self.artist_ids, self.venue_ids, self.alive)))
+            indexes = sys.getsizeof(self.order) + deep_sizeof(self.by_artist) + deep_sizeof(self.by_venue)
+            names = deep_sizeof(self.artists) + deep_sizeof(self.venues)
+        return {'columns': columns, 'indexes': indexes, 'names': names, 'total': columns + indexes + names}
+
+    def stats(self):
+        with self.lock:
+            memory = self.memory()
+            return {
+                'shows': self.live_count,
+                'slots': len(self.ids),
+                'artists': len(self.artists),
+                'venues': len(self.venues),
+                'refreshes': dict(self.refreshes),
+                'memory': memory,
+                'bytes_per_show': memory['total'] / self.live_count if self.live_count else 0,
+                'megabytes_per_million_shows': memory['total'] / self.live_count * 10 ** 6 / 2 ** 20 if self.live_count else 0,
+            }
+
+
+def register_timeline(app):
+    """
+    Create the app's show timeline when `SHOW_TIMELINE` is on, and wire its
+    stats view and `timeline` command.
+
+    :param app:
+    """
+    if not app.config.get('SHOW_TIMELINE'):
+        return None
+
+    timeline = ShowTimeline(
+        refresh_interval=app.config.get('SHOW_TIMELINE_REFRESH', 5),
+        rebuild_interval=app.config.get('SHOW_TIMELINE_REBUILD', 600),
+    )
+    app.extensions['show_timeline'] = timeline
+
+    @app.route('/admin/timeline')
+    def timeline_stats():
+        """
+        Controller to report show timeline size and memory use.
+        """
+        timeline.ensure_fresh()
+        return jsonify(timeline.stats())
+
+    @app.cli.group('timeline')
+    def timeline_command():
+        """In-memory show timeline commands."""
+
+    @timeline_command.command('stats')
+    def stats_command():
+        """Build the timeline and report its memory use."""
+        started_at = time.perf_counter()
+        timeline.rebuild()
+        elapsed = time.perf_counter() - started_at
+        stats = timeline.stats()
+        click.echo(f'{stats["shows"]} shows, {stats["artists"]} artists, {stats["venues"]} venues '
+                   f'built in {elapsed * 1000:.0f} ms')
+        for part, size in stats['memory'].items():
+            click.echo(f'{part}: {size / 2 ** 20:.1f} MB')
+        click.echo(f'{stats["bytes_per_show"]:.1f} bytes per show, '
+                   f'{stats["megabytes_per_million_shows"]:.1f} MB per million shows')
+
+    return timeline